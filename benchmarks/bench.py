@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks of bytehand client against local fake gateway.
+
+Usage:
+    $ python benchmarks/bench.py                    # all scenarios
+    $ python benchmarks/bench.py send_bulk stream   # chosen scenarios
+    $ python benchmarks/bench.py --latency 0.02 --messages 20000
+
+Every run is appended to benchmarks/results.jsonl and compared with the
+previous run of the same scenario with the same parameters.
+
+Fake gateway runs in the same process, so absolute numbers include its
+own cost. Compare runs made on the same machine only.
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import bytehand
+from bytehand.testing import FakeGateway
+
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'results.jsonl')
+
+
+def _messages(count):
+    for n in xrange(count):
+        yield {'to': str(79000000000 + n), 'from': 'bench',
+               'text': 'Benchmark message {0}'.format(n)}
+
+
+def bench_send(conn, args):
+    count = min(args.messages, 1000)
+    for msg in _messages(count):
+        conn.send(to=msg['to'], signature=msg['from'], text=msg['text'])
+    return count
+
+
+def bench_send_multi(conn, args):
+    msgs = list(_messages(args.messages))
+    for offset in xrange(0, len(msgs), args.chunk_size):
+        conn.send_multi(msgs[offset:offset + args.chunk_size])
+    return len(msgs)
+
+
+def bench_send_bulk(conn, args):
+    result = conn.send_bulk(list(_messages(args.messages)),
+                            chunk_size=args.chunk_size, workers=args.workers)
+    return len(result)
+
+
+def bench_stream(conn, args):
+    count = 0
+    for _ in conn.send_stream(_messages(args.messages),
+                              chunk_size=args.chunk_size,
+                              workers=args.workers):
+        count += 1
+    return count
+
+
+def bench_template(conn, args):
+    recipients = ((str(79000000000 + n), {'n': n})
+                  for n in xrange(args.messages))
+    count = 0
+    for _ in conn.send_template('Benchmark message {n}', 'bench', recipients,
+                                chunk_size=args.chunk_size,
+                                workers=args.workers):
+        count += 1
+    return count
+
+
+def bench_async(conn, args):
+    count = min(args.messages, 5000)
+    with bytehand.AsyncConnection(userid=conn.userid, key=conn.key,
+                                  concurrency=args.workers,
+                                  api_url=args.url) as async_conn:
+        for instrument in conn._instruments:
+            async_conn.connection.add_instrument(instrument)
+        futures = [async_conn.send(to=msg['to'], signature=msg['from'],
+                                   text=msg['text'])
+                   for msg in _messages(count)]
+        for future in futures:
+            future.result()
+    return count
+
+
+def bench_polling(conn, args):
+    count = min(args.messages, 2000)
+    msgids = [resp.description for resp in
+              conn.send_bulk(list(_messages(count)),
+                             chunk_size=args.chunk_size,
+                             workers=args.workers)]
+    with bytehand.DeliveryTracker(conn, msgids, workers=args.workers,
+                                  min_interval=0, max_interval=0) as tracker:
+        tracker.run()
+    return count
+
+
+SCENARIOS = [
+    ('send', bench_send),
+    ('send_multi', bench_send_multi),
+    ('send_bulk', bench_send_bulk),
+    ('stream', bench_stream),
+    ('template', bench_template),
+    ('async', bench_async),
+    ('polling', bench_polling),
+]
+
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(name, func, args):
+    collector = bytehand.MetricsCollector(
+        buckets=[x / 10000.0 for x in xrange(1, 10000)])
+    with bytehand.Connection(userid=1, key='bench', api_url=args.url,
+                             pool_maxsize=args.workers) as conn:
+        conn.add_instrument(collector)
+        gc.collect()
+        rss_before = _max_rss_kb()
+        started = time.time()
+        messages = func(conn, args)
+        elapsed = time.time() - started
+    requests = sum(h.count for h in collector.latency.values())
+    merged = bytehand.metrics.Histogram(collector._buckets)
+    for histogram in collector.latency.values():
+        merged.counts = [a + b for a, b in zip(merged.counts,
+                                               histogram.counts)]
+        merged.count += histogram.count
+    return {
+        'scenario': name,
+        'messages': messages,
+        'requests': requests,
+        'seconds': round(elapsed, 4),
+        'messages_per_second': round(messages / elapsed, 1),
+        'p50_ms': round(merged.quantile(0.5) * 1000, 2),
+        'p99_ms': round(merged.quantile(0.99) * 1000, 2),
+        'max_rss_growth_kb': _max_rss_kb() - rss_before,
+    }
+
+
+def _params(args):
+    return {'latency': args.latency, 'error_rate': args.error_rate,
+            'messages': args.messages, 'chunk_size': args.chunk_size,
+            'workers': args.workers}
+
+
+def _previous(result, params):
+    if not os.path.exists(RESULTS):
+        return None
+    previous = None
+    with open(RESULTS) as results:
+        for line in results:
+            record = json.loads(line)
+            if record['scenario'] == result['scenario'] and \
+                    record['params'] == params:
+                previous = record
+    return previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('scenarios', nargs='*',
+                        help='scenarios to run: {0}'.format(
+                            ', '.join(name for name, _ in SCENARIOS)))
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='fake gateway latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--no-save', action='store_true',
+                        help="don't append results to results.jsonl")
+    args = parser.parse_args(argv)
+    chosen = [(name, func) for name, func in SCENARIOS
+              if not args.scenarios or name in args.scenarios]
+    params = _params(args)
+
+    with FakeGateway(latency=args.latency,
+                     error_rate=args.error_rate) as gateway:
+        args.url = gateway.url
+        for name, func in chosen:
+            result = run(name, func, args)
+            previous = _previous(result, params)
+            change = ''
+            if previous is not None:
+                change = ' ({0:+.1f}% vs {1})'.format(
+                    100.0 * (result['messages_per_second'] /
+                             previous['messages_per_second'] - 1),
+                    previous['revision'])
+            print ('{scenario:<12} {messages_per_second:>10.1f} msg/s  '
+                   'p50 {p50_ms:>7.2f} ms  p99 {p99_ms:>7.2f} ms  '
+                   'rss +{max_rss_growth_kb} kB'.format(**result) + change)
+            if not args.no_save:
+                result.update(params=params, revision=_revision(),
+                              time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+                with open(RESULTS, 'a') as results:
+                    results.write(json.dumps(result, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Cold start benchmark of bytehand imports.
+
+Usage:
+    $ python benchmarks/import_time.py
+    $ python benchmarks/import_time.py --repeat 50 --max-ms 10
+
+Every statement is timed in fresh interpreter, time of bare
+interpreter start is subtracted. With --max-ms exits with status 1 if
+median time of `import bytehand` exceeds the limit.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+STATEMENTS = [
+    ('import', 'import bytehand'),
+    ('connection', 'from bytehand import Connection'),
+    ('send_sms', 'from bytehand import send_sms'),
+    ('http', 'import bytehand; bytehand.Connection(1, "k")._get_session()'),
+    ('everything', 'from bytehand import *'),
+]
+
+_TIMER = ('import time, sys; started = time.time(); {0}; '
+          'sys.stdout.write("%f %d" % (time.time() - started, '
+          'len(sys.modules)))')
+
+
+def measure(statement, repeat):
+    """:returns: (median seconds, number of loaded modules)."""
+    timings = []
+    for _ in xrange(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', _TIMER.format(statement)], cwd=ROOT)
+        seconds, modules = output.split()
+        timings.append(float(seconds))
+    timings.sort()
+    return timings[len(timings) // 2], int(modules)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='fail if `import bytehand` is slower')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, statement in STATEMENTS:
+        seconds, modules = measure(statement, args.repeat)
+        results[name] = seconds
+        print '{0:<12} {1:>8.2f} ms  {2:>4} modules'.format(
+            name, seconds * 1000, modules)
+    if args.max_ms is not None and results['import'] * 1000 > args.max_ms:
+        print >> sys.stderr, '`import bytehand` is slower than {0} ms'.format(
+            args.max_ms)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""CPU microbenchmarks of bytehand protocol core, no I/O involved.
+
+Usage:
+    $ python benchmarks/protocol_bench.py
+    $ python benchmarks/protocol_bench.py --batch 1000 --repeat 7
+
+Every case prints the best of @repeat runs in operations per second.
+"""
+
+import os
+import sys
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bytehand.protocol import Protocol
+from bytehand.connection import _SMSResponse
+
+
+def cases(proto, batch):
+    msgs = [{'to': str(79000000000 + n), 'from': 'bench',
+             'text': 'Benchmark message {0}'.format(n)}
+            for n in xrange(batch)]
+    body = json.dumps([{'status': 0, 'description': str(10 ** 10 + n)}
+                       for n in xrange(batch)])
+    balance = '{"status": 0, "description": "100500.00"}'
+    request = proto.balance()
+
+    def parse_send_multi():
+        list(_SMSResponse.from_response(None, proto.loads(body)))
+
+    def parse_balance():
+        proto.check_http(request, 200)
+        proto.check_status(proto.loads(balance))
+
+    return [
+        ('balance_request', 1, proto.balance),
+        ('details_request', 1, lambda: proto.details('10000000001')),
+        ('send_multi_request', batch, lambda: proto.send_multi(msgs)),
+        ('parse_balance', 1, parse_balance),
+        ('parse_send_multi', batch, parse_send_multi),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--batch', type=int, default=100,
+                        help='messages in send_multi request')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seconds', type=float, default=0.2,
+                        help='approximate duration of one run')
+    args = parser.parse_args(argv)
+
+    proto = Protocol(userid=1342, key='5C3D5D3C2B1C4D8B')
+    for name, messages, func in cases(proto, args.batch):
+        timer = timeit.Timer(func)
+        number = 1
+        while timer.timeit(number) < args.seconds / 10:
+            number *= 10
+        best = min(timer.repeat(args.repeat, number)) / number
+        print '{0:<20} {1:>12.0f} ops/s {2:>12.0f} msg/s'.format(
+            name, 1 / best, messages / best)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,82 @@
 # -*- coding: utf-8 -*-
 """Bytehand -- module for work with sms gateway 'bytehand.com'
+
+Submodules are imported on first access to their names, so
+`import bytehand` doesn't load http stack until it is needed.
 """
 
-from definitions import API_URL
-from send import send_sms
-from connection import Connection
+import sys
+import types
+import importlib
+
+_EXPORTS = {
+    'definitions': ['API_URL'],
+    'send': ['send_sms'],
+    'connection': ['Connection', 'ConnectionError', 'HTTPError'],
+    'protocol': ['Protocol'],
+    'bulk': ['BulkResult', 'BulkSendError', 'ChunkFailure'],
+    'async_connection': ['AsyncConnection'],
+    'tracker': ['DeliveryTracker'],
+    'balance': ['BalanceMonitor'],
+    'ratelimit': ['RateLimiter'],
+    'retry': ['RetryPolicy'],
+    'dedup': ['Deduplicator'],
+    'results': ['ResultStore'],
+    'outbox': ['Outbox'],
+    'validate': ['BatchValidator'],
+    'parts': ['Tariff', 'count_parts', 'estimate'],
+    'template': ['Template'],
+    'metrics': ['MetricsCollector', 'StatsdExporter', 'prometheus_text'],
+    'webhook': ['DeliveryReceiver'],
+    'group': ['ConnectionGroup'],
+    'deferred': ['DeferredSender', 'DeliveryWindow'],
+    'scheduler': ['SendScheduler',
+                  'PRIORITY_HIGH', 'PRIORITY_NORMAL', 'PRIORITY_LOW'],
+}
+
+__all__ = ['API_URL', 'send_sms', 'Connection', 'Protocol', 'AsyncConnection',
+           'ConnectionError', 'HTTPError', 'RetryPolicy', 'Deduplicator',
+           'BulkResult', 'BulkSendError', 'ChunkFailure', 'DeliveryTracker',
+           'BalanceMonitor', 'RateLimiter', 'SendScheduler', 'ResultStore',
+           'Outbox', 'BatchValidator', 'Tariff', 'count_parts', 'estimate',
+           'Template', 'MetricsCollector', 'StatsdExporter', 'prometheus_text',
+           'DeliveryReceiver', 'ConnectionGroup', 'DeferredSender',
+           'DeliveryWindow',
+           'PRIORITY_HIGH', 'PRIORITY_NORMAL', 'PRIORITY_LOW']
+
+
+class _LazyModule(types.ModuleType):
+    """Package module importing submodules on attribute access."""
+
+    def __init__(self, module):
+        super(_LazyModule, self).__init__(module.__name__, module.__doc__)
+        self.__dict__.update(module.__dict__)
+        # Python 2 clears globals of deallocated module.
+        self._module = module
+        self._origins = dict((name, submodule)
+                             for submodule, names in _EXPORTS.iteritems()
+                             for name in names)
+
+    def __getattr__(self, name):
+        submodule = self._origins.get(name)
+        if submodule is not None:
+            value = getattr(self._import(submodule), name)
+        elif name.startswith('_'):
+            raise AttributeError(name)
+        else:
+            try:
+                value = self._import(name)
+            except ImportError:
+                raise AttributeError(
+                    "'module' object has no attribute '{0}'".format(name))
+        setattr(self, name, value)
+        return value
+
+    def _import(self, submodule):
+        return importlib.import_module('.' + submodule, self.__name__)
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(__all__))
+
 
-__all__ = ['API_URL', 'send_sms', 'Connection']
+sys.modules[__name__] = _LazyModule(sys.modules[__name__])
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""Entry point for `python -m bytehand`."""
+
+import sys
+
+from bytehand.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Non-blocking connection to bytehand.
+
+Every call returns `Future` immediately, requests are executed
+by bounded pool of threads sharing one pooled http session:
+    >>> conn = AsyncConnection(userid=1342, key='5C3D5D3C2B1C4D8B')
+    >>> future = conn.send(to=1234567890, text='Hi!',
+    ...                    signature='bytehand')   # doctest:+SKIP
+    >>> response = future.result()                  # doctest:+SKIP
+    >>> response.is_delivered().add_done_callback(
+    ...     on_delivered)                           # doctest:+SKIP
+"""
+
+from multiprocessing.pool import ThreadPool
+
+from connection import Connection
+from future import Future
+
+
+class AsyncConnection(object):
+    """Non-blocking variant of `Connection`.
+
+    :param userid: Your bytehand api id.
+    :param key: Your bytehand api key.
+    :param concurrency: max number of requests executed at once.
+
+    Other keyword arguments are passed to `Connection`.
+    """
+
+    def __init__(self, userid=None, key=None, concurrency=10, **kwargs):
+        kwargs.setdefault('pool_maxsize', concurrency)
+        self.connection = Connection(userid=userid, key=key, **kwargs)
+        self.concurrency = concurrency
+        self._pool = ThreadPool(concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Wait for started requests and close connection."""
+        self._pool.close()
+        self._pool.join()
+        self.connection.close()
+
+    def send(self, to=None, signature=None, text=None):
+        """:returns: `Future` of `AsyncSMSResponse`.
+
+        :see: `Connection.send`
+        """
+        return self._submit(lambda: AsyncSMSResponse(
+            self, self.connection.send(to=to, signature=signature,
+                                       text=text)))
+
+    def send_multi(self, msgs):
+        """:returns: `Future` of list of `AsyncSMSResponse`.
+
+        :see: `Connection.send_multi`
+        """
+        return self._submit(lambda: [
+            AsyncSMSResponse(self, response)
+            for response in self.connection.send_multi(msgs)
+        ])
+
+    def details(self, msgid):
+        """:returns: `Future` of message details dict.
+
+        :see: `Connection.details`
+        """
+        return self._submit(self.connection.details, msgid)
+
+    def balance(self):
+        """:returns: `Future` of balance.
+
+        :see: `Connection.balance`
+        """
+        return self._submit(self.connection.balance)
+
+    def signatures(self, state=None):
+        """:returns: `Future` of signature list.
+
+        :see: `Connection.signatures`
+        """
+        return self._submit(self.connection.signatures, state)
+
+    def signature(self, signature):
+        """:returns: `Future` of signature details.
+
+        :see: `Connection.signature`
+        """
+        return self._submit(self.connection.signature, signature)
+
+    def new_signature(self, signature, description):
+        """:returns: `Future` finished when signature is sent.
+
+        :see: `Connection.new_signature`
+        """
+        return self._submit(self.connection.new_signature,
+                            signature, description)
+
+    def delete_signature(self, signature):
+        """:returns: `Future` finished when signature is deleted.
+
+        :see: `Connection.delete_signature`
+        """
+        return self._submit(self.connection.delete_signature, signature)
+
+    def _submit(self, func, *args):
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as error:
+                future.set_exception(error)
+        self._pool.apply_async(run)
+        return future
+
+
+class AsyncSMSResponse(object):
+    """Sms sending response with non-blocking details access.
+
+    :param conn: `AsyncConnection` the message was sent by.
+    :param response: blocking `_SMSResponse`.
+    """
+
+    def __init__(self, conn, response):
+        self._connection = conn
+        self.response = response
+
+    @property
+    def ok(self):
+        """Check is sms sending response is ok."""
+        return self.response.ok
+
+    @property
+    def status(self):
+        return self.response.status
+
+    @property
+    def description(self):
+        return self.response.description
+
+    def details(self):
+        """:returns: `Future` of detailed information about sended sms."""
+        return self._connection._submit(lambda: self.response.details)
+
+    def is_delivered(self):
+        """:returns: `Future` of bool, is sms delivered to reciever."""
+        return self._connection._submit(lambda: self.response.is_delivered)
+
+    def delivery_status(self):
+        """:returns: `Future` of sms delivery status."""
+        return self._connection._submit(
+            lambda: self.response.delivery_status)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Cached account balance with low balance notifications.
+
+    >>> def alarm(threshold, balance):
+    ...     print 'Balance {0} is below {1}'.format(balance, threshold)
+    >>> monitor = BalanceMonitor(conn, ttl=30, thresholds=[100, 10],
+    ...                          on_threshold=alarm)    # doctest:+SKIP
+    >>> monitor.value()                                 # doctest:+SKIP
+    Decimal('100500.00')
+
+Between `balance` requests monitor estimates balance locally: costs
+from `details` responses of the connection are subtracted from the last
+fetched value.
+"""
+
+import time
+import threading
+from decimal import Decimal
+from collections import OrderedDict
+
+
+class BalanceMonitor(object):
+    """Account balance cache.
+
+    :param conn: `Connection` to monitor balance of.
+    :param ttl: seconds to cache fetched balance.
+    :param thresholds: balance values to notify about.
+    :param on_threshold: callable called with (threshold, balance)
+                         when balance falls below threshold. Called
+                         again only after balance rises above threshold.
+    :param track_costs: subtract message costs seen in `details`
+                        responses from cached balance.
+    :param max_charged: number of recently charged message ids to
+                        remember, so repeated `details` polls of one
+                        message are not charged twice.
+    """
+
+    def __init__(self, conn, ttl=30, thresholds=(), on_threshold=None,
+                 track_costs=True, max_charged=100000):
+        self._connection = conn
+        self.ttl = ttl
+        self.thresholds = sorted((Decimal(str(t)) for t in thresholds),
+                                 reverse=True)
+        self.on_threshold = on_threshold
+        self._lock = threading.Lock()
+        self._fetched = None
+        self._fetched_at = None
+        self._spent = Decimal(0)
+        self._charged = OrderedDict()
+        self.max_charged = max_charged
+        self._in_flight = None
+        self._fetch_error = None
+        self._below = set()
+        if track_costs:
+            conn.add_details_listener(self._on_details)
+
+    def close(self):
+        """Stop tracking costs of connection messages."""
+        try:
+            self._connection.remove_details_listener(self._on_details)
+        except ValueError:
+            pass
+
+    def value(self):
+        """:returns: Decimal, account balance in rubles.
+
+        Balance is requested at most once per `ttl` seconds. Concurrent
+        callers share one request.
+        """
+        with self._lock:
+            if self._fresh():
+                return self._fetched - self._spent
+            in_flight = self._in_flight
+            if in_flight is None:
+                in_flight = self._in_flight = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if owner:
+            try:
+                self._fetch()
+            finally:
+                with self._lock:
+                    self._in_flight = None
+                in_flight.set()
+        else:
+            in_flight.wait()
+
+        with self._lock:
+            if self._fetched is None:
+                raise self._fetch_error
+            return self._fetched - self._spent
+
+    def estimate(self):
+        """:returns: Decimal, last fetched balance minus costs seen since.
+
+        Balance is requested only if it was never fetched.
+        """
+        with self._lock:
+            if self._fetched is not None:
+                return self._fetched - self._spent
+        return self.value()
+
+    def refresh(self):
+        """Drop cached balance and request it again."""
+        with self._lock:
+            self._fetched_at = None
+        return self.value()
+
+    def record_cost(self, msgid, cost):
+        """Subtract @cost of message @msgid from cached balance.
+
+        Cost of every message is counted once, fetched balance is
+        assumed to include costs of already charged messages.
+        """
+        with self._lock:
+            if msgid in self._charged:
+                self._charged[msgid] = self._charged.pop(msgid)
+                return
+            self._charged[msgid] = True
+            if len(self._charged) > self.max_charged:
+                self._charged.popitem(last=False)
+            if self._fetched is None:
+                return
+            self._spent += Decimal(str(cost))
+            balance = self._fetched - self._spent
+        self._check_thresholds(balance)
+
+    def _fresh(self):
+        return self._fetched_at is not None \
+            and time.time() - self._fetched_at < self.ttl
+
+    def _fetch(self):
+        try:
+            balance = Decimal(str(self._connection.balance()))
+        except Exception as error:
+            with self._lock:
+                self._fetch_error = error
+            raise
+        with self._lock:
+            self._fetched = balance
+            self._fetched_at = time.time()
+            self._spent = Decimal(0)
+        self._check_thresholds(balance)
+
+    def _on_details(self, msgid, details):
+        if details.get('cost') is not None:
+            self.record_cost(msgid, details['cost'])
+
+    def _check_thresholds(self, balance):
+        if self.on_threshold is None:
+            return
+        crossed = []
+        with self._lock:
+            for threshold in self.thresholds:
+                if balance < threshold:
+                    if threshold not in self._below:
+                        self._below.add(threshold)
+                        crossed.append(threshold)
+                else:
+                    self._below.discard(threshold)
+        for threshold in crossed:
+            self.on_threshold(threshold, balance)
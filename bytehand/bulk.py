@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Bulk sms sending.
+
+Big message lists are split in chunks of gateway-acceptable size,
+chunks are sent concurrently:
+    >>> from bytehand import Connection
+    >>> conn = Connection(userid=1342, key='5C3D5D3C2B1C4D8B')
+    >>> result = conn.send_bulk(msgs, workers=4)    # doctest:+SKIP
+    >>> result.ok                                   # doctest:+SKIP
+    True
+
+Messages from any iterable may be streamed, responses are yielded
+as soon as chunks are sent:
+    >>> for response in conn.send_stream(rows):     # doctest:+SKIP
+    ...     print response.description
+"""
+
+import collections
+import itertools
+
+from definitions import SEND_MULTI_CHUNK_SIZE
+
+
+class ChunkFailure(object):
+    """Failed chunk of bulk sending.
+
+    :param offset: index of first chunk message in input list.
+    :param msgs: messages of failed chunk.
+    :param error: exception raised while chunk sending.
+    """
+
+    def __init__(self, offset, msgs, error):
+        self.offset = offset
+        self.msgs = msgs
+        self.error = error
+
+    def __repr__(self):
+        return 'ChunkFailure(offset={0}, size={1}, error={2!r})'.format(
+            self.offset, len(self.msgs), self.error)
+
+
+class BulkSendError(Exception):
+    """Raised by streaming send if chunk failed.
+
+    :param failure: `ChunkFailure` of failed chunk.
+    """
+
+    def __init__(self, failure):
+        super(BulkSendError, self).__init__(
+            'Failed to send {0} messages '.format(len(failure.msgs)) +
+            'from offset {0}: {1}'.format(failure.offset, failure.error)
+        )
+        self.failure = failure
+
+
+class BulkResult(list):
+    """List of `_SMSResponse` in order of input messages.
+
+    Messages from failed chunks have None instead of response,
+    failed chunks are listed in `failures`.
+    """
+
+    def __init__(self, responses=(), failures=()):
+        super(BulkResult, self).__init__(responses)
+        self.failures = list(failures)
+
+    @property
+    def ok(self):
+        """True if all chunks were sent."""
+        return not self.failures
+
+
+def iter_chunks(msgs, chunk_size):
+    """Split @msgs iterable in (offset, chunk) pairs lazily."""
+    if chunk_size < 1:
+        raise ValueError('Chunk size must be positive, '
+                         'but it is: {0}'.format(chunk_size))
+    msgs = iter(msgs)
+    offset = 0
+    while True:
+        chunk = list(itertools.islice(msgs, chunk_size))
+        if not chunk:
+            return
+        yield offset, chunk
+        offset += len(chunk)
+
+
+def _dispatch(send, chunks, workers):
+    """Send @chunks with @send at most @workers requests in flight.
+
+    Yields (offset, chunk, result) in order of @chunks, where result
+    is list of responses or `ChunkFailure`. Not more than @workers + 1
+    chunks are held in memory at once.
+    """
+    def send_chunk(chunk):
+        offset, chunk_msgs = chunk
+        try:
+            return send(chunk_msgs)
+        except Exception as error:
+            return ChunkFailure(offset, chunk_msgs, error)
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield chunk + (send_chunk(chunk),)
+        return
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(workers)
+    in_flight = collections.deque()
+    try:
+        for chunk in chunks:
+            if len(in_flight) >= workers:
+                done_chunk, result = in_flight.popleft()
+                yield done_chunk + (result.get(),)
+            in_flight.append((chunk, pool.apply_async(send_chunk, (chunk,))))
+        while in_flight:
+            done_chunk, result = in_flight.popleft()
+            yield done_chunk + (result.get(),)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def send_bulk(conn, msgs, chunk_size=SEND_MULTI_CHUNK_SIZE, workers=4):
+    """Send @msgs by chunks of @chunk_size in @workers threads.
+
+    :param conn: `Connection` to send messages with.
+    :param msgs: iterable of dicts (messages) in `send_multi` format.
+    :param chunk_size: max number of messages in one request.
+    :param workers: max number of concurrent requests.
+
+    :returns: `BulkResult`.
+    """
+    result = BulkResult()
+    chunks = iter_chunks(msgs, chunk_size)
+    for offset, chunk_msgs, chunk_result in _dispatch(conn.send_multi,
+                                                      chunks, workers):
+        if isinstance(chunk_result, ChunkFailure):
+            result.failures.append(chunk_result)
+            result.extend([None] * len(chunk_msgs))
+        else:
+            result.extend(chunk_result)
+    return result
+
+
+def send_stream(conn, msgs, chunk_size=SEND_MULTI_CHUNK_SIZE, workers=4,
+                on_error=None):
+    """Send messages from @msgs iterable, yield responses in input order.
+
+    Messages are consumed from @msgs lazily and json-encoded by chunks,
+    so memory usage is bounded by @chunk_size * (@workers + 1) messages.
+
+    :param conn: `Connection` to send messages with.
+    :param msgs: iterable of dicts (messages) in `send_multi` format.
+    :param chunk_size: max number of messages in one request.
+    :param workers: max number of concurrent requests.
+    :param on_error: callable called with `ChunkFailure` of each failed
+                     chunk. If not set, `BulkSendError` is raised.
+    """
+    return stream(conn.send_multi, msgs, chunk_size=chunk_size,
+                  workers=workers, on_error=on_error)
+
+
+def stream(send, items, chunk_size=SEND_MULTI_CHUNK_SIZE, workers=4,
+           on_error=None):
+    """Send @items by chunks with @send, yield responses in input order.
+
+    :param send: callable sending list of items, returns responses.
+
+    :see: `send_stream` for other parameters.
+    """
+    chunks = iter_chunks(items, chunk_size)
+    for offset, chunk_items, chunk_result in _dispatch(send, chunks,
+                                                       workers):
+        if isinstance(chunk_result, ChunkFailure):
+            if on_error is None:
+                raise BulkSendError(chunk_result)
+            on_error(chunk_result)
+            continue
+        for response in chunk_result:
+            yield response
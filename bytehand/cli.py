@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""Command line tool for bulk sms sending.
+
+Usage:
+    $ python -m bytehand --userid 1342 --key 5C3D5D3C2B1C4D8B \\
+    >     --signature bytehand --workers 4 recipients.csv > results.jsonl
+
+Input is CSV with header or JSONL. Records have fields "to", "text" and
+optional "from" (or "signature"), which defaults to --signature value.
+Every input record gets JSONL result line:
+    {"line": 1, "to": "79001234567", "status": 0, "description": "4242"}
+Records failed validation or sending have "error" field instead.
+Summary is printed to stderr.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import collections
+import multiprocessing
+
+from connection import Connection
+from send import check_message
+
+
+_connection = None
+
+
+def _init_worker(userid, key, timeout):
+    global _connection
+    _connection = Connection(userid=userid, key=key, timeout=timeout)
+
+
+def _send_batch(batch):
+    """Send batch of (line, msg) pairs in worker process.
+
+    :returns: (batch, responses or error string, seconds spent).
+    """
+    started = time.time()
+    try:
+        responses = _connection.send_multi([msg for _, msg in batch])
+        result = [(resp.status, resp.description) for resp in responses]
+    except Exception as error:
+        result = '{0}: {1}'.format(type(error).__name__, error)
+    return batch, result, time.time() - started
+
+
+def read_records(stream, fmt):
+    """Yield records from @stream in 'csv' or 'jsonl' @fmt."""
+    if fmt == 'csv':
+        for record in csv.DictReader(stream):
+            yield record
+    elif fmt == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError('Unknown input format: {0}'.format(fmt))
+
+
+def validate(records, signature=None):
+    """Yield (line, msg, error) for @records. Exactly one of msg and
+    error is None.
+    """
+    for line, record in enumerate(records, 1):
+        sign = record.get('from') or record.get('signature') or signature
+        try:
+            to = check_message(record.get('to', ''), sign,
+                               record.get('text'))
+        except TypeError as error:
+            yield line, None, str(error)
+        else:
+            yield line, {'to': to, 'from': sign,
+                         'text': record['text']}, None
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+class _Summary(object):
+
+    def __init__(self):
+        self.started = time.time()
+        self.sent = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = []
+
+    def write(self, stream):
+        elapsed = time.time() - self.started
+        total = self.sent + self.failed + self.rejected
+        stream.write(
+            'messages: {0}, sent: {1}, failed: {2}, rejected: {3}\n'
+            'elapsed: {4:.2f}s, throughput: {5:.1f} msg/s\n'
+            'batch latency: p50 {6:.3f}s, p99 {7:.3f}s\n'.format(
+                total, self.sent, self.failed, self.rejected,
+                elapsed, self.sent / elapsed if elapsed else 0.0,
+                _percentile(self.latencies, 50),
+                _percentile(self.latencies, 99)))
+
+
+def _batches(validated, batch_size):
+    """Yield (rejects, batch): (line, error) pairs of records failed
+    validation before @batch, and batch of valid (line, msg) pairs.
+    Both lists are at most @batch_size long, one of them may be empty.
+    """
+    rejects = []
+    batch = []
+    for line, msg, error in validated:
+        if error is not None:
+            rejects.append((line, error))
+        else:
+            batch.append((line, msg))
+        if len(batch) >= batch_size or len(rejects) >= batch_size:
+            yield rejects, batch
+            rejects = []
+            batch = []
+    if rejects or batch:
+        yield rejects, batch
+
+
+def _send_all(batches, pool, window):
+    """Yield (rejects, `_send_batch` result or None) in order of
+    @batches, keeping at most @window batches queued in @pool.
+    """
+    if pool is None:
+        for rejects, batch in batches:
+            yield rejects, _send_batch(batch) if batch else None
+        return
+    in_flight = collections.deque()
+    for rejects, batch in batches:
+        if len(in_flight) >= window:
+            done_rejects, result = in_flight.popleft()
+            yield done_rejects, result.get() if result else None
+        in_flight.append(
+            (rejects, pool.apply_async(_send_batch, (batch,)) if batch
+             else None))
+    while in_flight:
+        done_rejects, result = in_flight.popleft()
+        yield done_rejects, result.get() if result else None
+
+
+def _write(output, result):
+    output.write(json.dumps(result) + '\n')
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m bytehand',
+        description='Send sms messages from CSV or JSONL file.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='input file, "-" for stdin (default)')
+    parser.add_argument('--userid',
+                        default=os.environ.get('BYTEHAND_USERID'),
+                        help='bytehand api id, $BYTEHAND_USERID by default')
+    parser.add_argument('--key', default=os.environ.get('BYTEHAND_KEY'),
+                        help='bytehand api key, $BYTEHAND_KEY by default')
+    parser.add_argument('--signature',
+                        help='signature for records without "from" field')
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='input format, guessed by file extension '
+                             'by default, jsonl for stdin')
+    parser.add_argument('--output', default='-',
+                        help='results file, "-" for stdout (default)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of sending processes')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='messages in one send_multi request')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='request timeout in seconds')
+    args = parser.parse_args(argv)
+    if args.userid is None or args.key is None:
+        parser.error('--userid and --key should be set')
+    if args.format is None:
+        args.format = 'csv' if args.input.endswith('.csv') else 'jsonl'
+    return args
+
+
+def _open(path, mode, default):
+    return default if path == '-' else open(path, mode)
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    """Run command line tool.
+
+    :returns: exit code, 0 if all messages were sent.
+    """
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    source = _open(args.input, 'rb', stdin or sys.stdin)
+    output = _open(args.output, 'wb', stdout or sys.stdout)
+    summary = _Summary()
+    validated = validate(read_records(source, args.format), args.signature)
+    batches = _batches(validated, args.batch_size)
+    init_args = (args.userid, args.key, args.timeout)
+
+    if args.workers <= 1:
+        _init_worker(*init_args)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(args.workers, _init_worker, init_args)
+
+    try:
+        for rejects, sent in _send_all(batches, pool, args.workers * 2):
+            for line, error in rejects:
+                summary.rejected += 1
+                _write(output, {'line': line, 'error': error})
+            if sent is None:
+                continue
+            batch, result, latency = sent
+            summary.latencies.append(latency)
+            if isinstance(result, basestring):
+                summary.failed += len(batch)
+                for line, msg in batch:
+                    _write(output, {'line': line, 'to': msg['to'],
+                                    'error': result})
+                continue
+            for (line, msg), (status, description) in zip(batch, result):
+                if str(status) == '0':
+                    summary.sent += 1
+                else:
+                    summary.failed += 1
+                _write(output, {'line': line, 'to': msg['to'],
+                                'status': status,
+                                'description': description})
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if output is not (stdout or sys.stdout):
+            output.close()
+        if source is not (stdin or sys.stdin):
+            source.close()
+
+    summary.write(stderr or sys.stderr)
+    return 0 if summary.failed == summary.rejected == 0 else 1
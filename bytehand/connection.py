@@ -10,18 +10,26 @@ Now you can use your connection for sms sending:
     ...     text='Hi!',
     ...     signature='bytehand'
     ... )
-"""
-
-import json
-import urlparse
-import urllib
-import requests
 
-from definitions import API_URL
+Connection keeps pool of http connections to bytehand alive between
+calls. Close it when you don't need it anymore or use it as context
+manager:
+    >>> with Connection(userid=1342, key='5C3D5D3C2B1C4D8B') as conn:
+    ...     conn.balance()                  # doctest:+SKIP
+"""
 
+import time
+import itertools
+import threading
 
-class ConnectionError(Exception):
-    pass
+import template
+import serializer as serializers
+import protocol
+from protocol import ConnectionError, HTTPError
+from definitions import (SEND_MULTI_CHUNK_SIZE, TERMINAL_STATES,
+                         STREAM_DECODE_MESSAGES, STREAM_DECODE_BYTES,
+                         intern_state)
+import bulk
 
 
 class Connection(object):
@@ -29,16 +37,109 @@ class Connection(object):
 
     :param userid: Your bytehand api id.
     :param key: Your bytehand api key.
+    :param pool_connections: number of per-host connection pools to cache.
+    :param pool_maxsize: max number of connections kept alive per host.
+    :param pool_block: block when no free connection in pool instead of
+                       opening extra one.
+    :param keep_alive: reuse connections between requests.
+    :param timeout: request timeout in seconds, float or
+                    (connect, read) tuple. None means wait forever.
+    :param signature_ttl: seconds to cache signature list for
+                          `signature` lookups. 0 disables caching.
+    :param rate_limiter: `bytehand.ratelimit.RateLimiter` to throttle
+                         requests and sent messages with.
+    :param retry: `bytehand.retry.RetryPolicy` for transient failures.
+                  Without it requests are never retried.
+    :param dedup: `bytehand.dedup.Deduplicator` to coalesce identical
+                  messages sent within short window.
+    :param api_url: bytehand api url, `API_URL` by default.
+    :param serializer: `bytehand.serializer.Serializer`, the fastest
+                       installed json library is used by default.
+
+    Connection is thread safe: one instance may be shared between
+    several threads.
+
+    Requests are built and responses are parsed by
+    `bytehand.protocol.Protocol`, connection only sends them.
 
     :see: https://www.bytehand.com/secure/settings to get your key and id.
     """
-    _API_URL = urlparse.urlparse(API_URL)
 
-    def __init__(self, userid=None, key=None):
+    def __init__(self, userid=None, key=None, pool_connections=1,
+                 pool_maxsize=10, pool_block=False, keep_alive=True,
+                 timeout=None, signature_ttl=60, rate_limiter=None,
+                 retry=None, api_url=None, serializer=None, dedup=None):
         if userid is None or key is None:
             raise ValueError('"userid" and "key" parameters should be set')
-        self.userid = userid
-        self.key = key
+        self._protocol = protocol.Protocol(userid, key, api_url, serializer)
+        self.timeout = timeout
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._pool_block = pool_block
+        self._keep_alive = keep_alive
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.signature_ttl = signature_ttl
+        self._signature_index = None
+        self._signature_lock = threading.Lock()
+        self._details_listeners = []
+        self._instruments = []
+        self.rate_limiter = rate_limiter
+        self.retry = retry
+        self.dedup = dedup
+
+    @property
+    def userid(self):
+        return self._protocol.userid
+
+    @property
+    def key(self):
+        return self._protocol.key
+
+    @property
+    def serializer(self):
+        return self._protocol.serializer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections.
+
+        Connection may still be used after close: new pool will be
+        opened on next request.
+        """
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def _get_session(self):
+        session = self._session
+        if session is not None:
+            return session
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._new_session()
+            return self._session
+
+    def _new_session(self):
+        # requests is heavy to import, it is loaded with the first request
+        import requests.adapters
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self._pool_connections,
+            pool_maxsize=self._pool_maxsize,
+            pool_block=self._pool_block
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self._keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
 
     def send(self, to=None, signature=None, text=None):
         """Send sms message to @to from @signature with given @text.
@@ -61,13 +162,103 @@ class Connection(object):
                      {"to": <TO>, "from": <SIGNATURE>, "text": <CONTENT>}
 
         :note: Your @signature must be verified on bytehand.
+        :note: With `retry` policy set only messages which didn't get
+               message id are sent again.
+        :note: With `dedup` set messages identical to recently sent ones
+               get their responses and are not sent again.
+        """
+        if self.dedup is not None:
+            return self.dedup.send_multi(self._send_multi_retried, msgs)
+        return self._send_multi_retried(msgs)
+
+    def _send_multi_retried(self, msgs):
+        if self.retry is not None:
+            attempts = itertools.count(1)
+            return self.retry.send_multi(
+                lambda msgs: self._send_multi(msgs, attempt=next(attempts)),
+                msgs)
+        return self._send_multi(msgs)
+
+    def _send_multi(self, msgs, attempt=1):
+        return self._send_encoded(self.serializer.encode_messages(msgs),
+                                  len(msgs), attempt)
+
+    def _send_encoded(self, data, count, attempt=1):
+        """Send json encoded list of @count messages."""
+        if self.rate_limiter is not None:
+            # Request token is taken by `_request_once`.
+            self.rate_limiter.acquire(count, requests=0)
+        stream = count >= STREAM_DECODE_MESSAGES
+        resp = self._request(self._protocol.send_encoded(data, count),
+                             attempt=attempt, verify=False, stream=stream)
+        items = self._parse_array(resp, 0) if stream else self._parse(resp)
+        return list(_SMSResponse.from_response(self, items))
+
+    def send_bulk(self, msgs, chunk_size=SEND_MULTI_CHUNK_SIZE, workers=4):
+        """Send any number of sms messages from given @msgs list.
+
+        Messages are sent by chunks of @chunk_size, at most @workers
+        chunks at once.
+
+        :param msgs: list of dicts (messages) in `send_multi` format.
+        :param chunk_size: max number of messages in one request.
+        :param workers: max number of concurrent requests.
+
+        :returns: `bytehand.bulk.BulkResult`, list of responses in order
+        of @msgs. Responses for messages from failed chunks are None,
+        failed chunks are listed in `failures` attribute.
+        """
+        return bulk.send_bulk(self, msgs, chunk_size=chunk_size,
+                              workers=workers)
+
+    def send_stream(self, msgs, chunk_size=SEND_MULTI_CHUNK_SIZE, workers=4,
+                    on_error=None):
+        """Send sms messages from @msgs iterable and yield responses.
+
+        Messages are read from @msgs lazily, responses are yielded in
+        order of @msgs as soon as their chunk is sent. At most
+        @chunk_size * (@workers + 1) messages are held in memory.
+
+        :param msgs: iterable of dicts (messages) in `send_multi` format.
+        :param chunk_size: max number of messages in one request.
+        :param workers: max number of concurrent requests.
+        :param on_error: callable called with `bytehand.bulk.ChunkFailure`
+                         for each failed chunk. If not set,
+                         `bytehand.bulk.BulkSendError` is raised.
+        """
+        return bulk.send_stream(self, msgs, chunk_size=chunk_size,
+                                workers=workers, on_error=on_error)
+
+    def send_template(self, tmpl, signature, recipients,
+                      chunk_size=SEND_MULTI_CHUNK_SIZE, workers=4,
+                      on_error=None):
+        """Send personalized messages and yield responses.
+
+        Texts are rendered lazily while chunk is encoded, json body of
+        request is built from precompiled @tmpl directly.
+
+        :param tmpl: `bytehand.template.Template` or template string,
+                     e.g. 'Hello, {name}!'.
+        :param signature: "from" field of all messages.
+        :param recipients: iterable of (to, variables) pairs, where
+                           variables is dict of template fields.
+
+        :see: `send_stream` for other parameters.
         """
-        data = json.dumps(msgs)
-        headers = {'Content-Type': 'application/json;charset=UTF-8'}
-        resp = self._post_request('send_multi', data=data, headers=headers,
-                                  qargs=dict(id=self.userid, key=self.key),
-                                  verify=False)
-        return list(_SMSResponse.from_response(self, resp))
+        if not isinstance(tmpl, template.Template):
+            tmpl = template.Template(tmpl)
+        encoder = template.BatchEncoder(tmpl, signature)
+
+        def send(chunk):
+            data = encoder.encode(chunk)
+            if self.retry is not None:
+                attempts = itertools.count(1)
+                return self.retry.call_send(
+                    lambda: self._send_encoded(data, len(chunk),
+                                               next(attempts)))
+            return self._send_encoded(data, len(chunk))
+        return bulk.stream(send, recipients, chunk_size=chunk_size,
+                           workers=workers, on_error=on_error)
 
     def details(self, msgid):
         """Get detailed information about message.
@@ -101,16 +292,37 @@ class Connection(object):
             `<COST>`
                 message cost in rubles.
         """
-        qargs = dict(id=self.userid, key=self.key, message=msgid)
-        resp = self._get_request('details', qargs=qargs, verify=False)
-        return resp.json()
+        resp = self._request(self._protocol.details(msgid), verify=False)
+        details = self._parse(resp)
+        for listener in self._details_listeners:
+            listener(msgid, details)
+        return details
+
+    def add_details_listener(self, listener):
+        """Call @listener with (msgid, details) on every `details` response.
+        """
+        self._details_listeners.append(listener)
+
+    def remove_details_listener(self, listener):
+        """Stop calling @listener added by `add_details_listener`."""
+        self._details_listeners.remove(listener)
+
+    def add_instrument(self, instrument):
+        """Call @instrument with `bytehand.metrics.RequestEvent` after
+        every http request.
+
+        Requests aren't timed at all while no instruments are added.
+        """
+        self._instruments.append(instrument)
+
+    def remove_instrument(self, instrument):
+        """Stop calling @instrument added by `add_instrument`."""
+        self._instruments.remove(instrument)
 
     def balance(self):
         """:returns: float, how much money in rubles on your account."""
-        qargs = dict(id=self.userid, key=self.key)
-        resp = self._get_request('balance', qargs=qargs, verify=False)
-        self._check_status(resp)
-        return resp.json()['description']
+        resp = self._request(self._protocol.balance(), verify=False)
+        return self._protocol.check_status(self._parse(resp))['description']
 
     def signatures(self, state=None):
         """Send `signatures` request to bytehand api.
@@ -144,15 +356,13 @@ class Connection(object):
             - 'REJECTED': You can't use this signature. It was
               checked by bytehand moderator and rejected.
         """
-        if state is not None and \
-            state.upper() not in ('NEW', 'ACCEPTED', 'REJECTED'):
-            raise ValueError('Bad `state` value: "{}"'.format(state))
-        qargs = dict(id=self.userid, key=self.key)
-        qargs.update(
-            {'state': state.upper()} if state is not None else {}
-        )
-        resp = self._get_request('signatures', qargs=qargs, verify=False)
-        return resp.json()
+        resp = self._request(self._protocol.signatures(state), verify=False,
+                             stream=True)
+        signatures = list(self._parse_array(resp))
+        if state is None:
+            self._signature_index = _SignatureIndex(
+                signatures, time.time() + self.signature_ttl)
+        return signatures
 
     def signature(self, signature):
         """:returns: dict, detailed information about given signature.
@@ -161,13 +371,50 @@ class Connection(object):
 
         :raises LookupError: if no given signature in signature list.
 
+        :note: signature list is cached for `signature_ttl` seconds.
+
         :see: signature dict format in `help(bytehand.signatures)`
         """
-        for sign_details in self.signatures():
-            if sign_details['text'] == signature:
-                return sign_details
-        raise LookupError('Can\'t find given signature {}'.format(signature) +
-                          ' in signature list.')
+        try:
+            return self._get_signature_index().by_text[signature]
+        except KeyError:
+            raise LookupError('Can\'t find given signature '
+                              '{} in signature list.'.format(signature))
+
+    def signature_by_id(self, signature_id):
+        """:returns: dict, detailed information about signature with
+        given @signature_id.
+
+        :raises LookupError: if no such signature in signature list.
+
+        :note: signature list is cached for `signature_ttl` seconds.
+        """
+        try:
+            return self._get_signature_index().by_id[signature_id]
+        except KeyError:
+            raise LookupError('Can\'t find signature with id '
+                              '{} in signature list.'.format(signature_id))
+
+    def refresh_signatures(self):
+        """Reload cached signature list."""
+        with self._signature_lock:
+            self.signatures()
+
+    def invalidate_signatures(self):
+        """Drop cached signature list. It will be reloaded on next lookup.
+        """
+        self._signature_index = None
+
+    def _get_signature_index(self):
+        index = self._signature_index
+        if index is not None and not index.expired():
+            return index
+        with self._signature_lock:
+            index = self._signature_index
+            if index is None or index.expired():
+                self.signatures()
+                index = self._signature_index
+        return index
 
     def new_signature(self, signature, description):
         """Send new signature to moderation.
@@ -175,11 +422,11 @@ class Connection(object):
         :param signature: signature text
         :param description: descriptions for moderator
         """
-        qargs = dict(id=self.userid, key=self.key, text=signature)
-        resp = self._post_request('signature', qargs=qargs,
-                                  data={'description': description},
-                                  verify=False)
-        self._check_status(resp)
+        resp = self._request(
+            self._protocol.new_signature(signature, description),
+            verify=False)
+        self.invalidate_signatures()
+        self._protocol.check_status(self._parse(resp))
 
     def delete_signature(self, signature):
         """Delete given @signature from your signature list.
@@ -192,46 +439,121 @@ class Connection(object):
             signature = self.signature(signature)
         except LookupError:
             return
-        qargs = dict(id=self.userid, key=self.key, signature=signature['id'])
-        resp = self._delete_request('signature', qargs=qargs, verify=False)
-        self._check_status(resp)
-
-    def _check_status(self, resp):
-        resp = resp.json()
-        if int(resp['status']) != 0:
-            raise ConnectionError(
-                'Nonzero status: {0}\n'.format(resp['status']) +
-                'Description: {0}'.format(resp['description'])
+        resp = self._request(
+            self._protocol.delete_signature(signature['id']), verify=False)
+        self.invalidate_signatures()
+        self._protocol.check_status(self._parse(resp))
+
+    def _parse(self, resp):
+        content = resp.content
+        event = self._pending_event(resp)
+        if event is not None:
+            self._emit(event.finished(resp))
+        return self._protocol.loads(content)
+
+    def _parse_array(self, resp, min_bytes=STREAM_DECODE_BYTES):
+        """Parse json array from @resp, incrementally if response is
+        not read yet and is at least @min_bytes long.
+        """
+        length = resp.headers.get('Content-Length')
+        if resp.raw is None or \
+                (length is not None and int(length) < min_bytes):
+            return self._parse(resp)
+        chunks = resp.iter_content(STREAM_DECODE_BYTES)
+        event = self._pending_event(resp)
+        if event is not None:
+            chunks = self._timed_chunks(resp, chunks, event)
+        return serializers.iter_array(chunks)
+
+    def _pending_event(self, resp):
+        """Take event of streamed @resp which body is not read yet."""
+        event = getattr(resp, '_bytehand_event', None)
+        if event is not None:
+            resp._bytehand_event = None
+        return event
+
+    def _timed_chunks(self, resp, chunks, event):
+        """Yield @chunks, emit @event when body is read or dropped."""
+        received = 0
+        failed = False
+        try:
+            for chunk in chunks:
+                received += len(chunk)
+                yield chunk
+        except Exception as error:
+            failed = True
+            self._emit(event.failed(error))
+            raise
+        finally:
+            if not failed:
+                self._emit(event.finished(resp, received))
+
+    def _request(self, request, attempt=1, **kwargs):
+        """Send `bytehand.protocol.Request` @request.
+
+        :param attempt: number of sending attempt, for instruments.
+        """
+        if self.retry is not None and request.method != 'post':
+            attempts = itertools.count(attempt)
+            return self.retry.call(
+                lambda: self._request_once(request, attempt=next(attempts),
+                                           **kwargs)
             )
-
-    def _request(self, method, request_type, qargs={}, data=None, **kwargs):
-        query = urllib.urlencode(qargs)
-        url = self._API_URL._replace(path=request_type, query=query).geturl()
-        resp = requests.request(method, url, data=data, **kwargs)
-        if not resp.ok:
-            raise ConnectionError('Http response error. '
-                                  'Status = {}. '.format(resp.status_code) +
-                                  'Url = "{}". '.format(url) +
-                                  'POST data: {}'.format(data))
+        return self._request_once(request, attempt, **kwargs)
+
+    def _request_once(self, request, attempt=1, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(messages=0)
+        session = self._get_session()
+        if self._instruments:
+            import metrics
+            event = metrics.RequestEvent(request.method, request.request_type,
+                                         attempt, request.batch_size,
+                                         request.body)
+            try:
+                resp = session.request(request.method, request.url,
+                                       data=request.body,
+                                       headers=request.headers, **kwargs)
+            except Exception as error:
+                self._emit(event.failed(error))
+                raise
+            if kwargs.get('stream') and resp.ok:
+                # Body is not read yet: event is emitted by the parser.
+                resp._bytehand_event = event
+            else:
+                self._emit(event.finished(resp))
+        else:
+            resp = session.request(request.method, request.url,
+                                   data=request.body, headers=request.headers,
+                                   **kwargs)
+        self._protocol.check_http(request, resp.status_code)
         return resp
 
-    def _delete_request(self, request_type, qargs, **kwargs):
-        return self._request('delete', request_type, qargs, **kwargs)
+    def _emit(self, event):
+        for instrument in self._instruments:
+            instrument(event)
+
+
+class _SignatureIndex(object):
+    """Signature list indexed by signature text and id."""
 
-    def _get_request(self, request_type, qargs, **kwargs):
-        return self._request('get', request_type, qargs, **kwargs)
+    def __init__(self, signatures, expires_at):
+        self.by_text = dict((sign['text'], sign) for sign in signatures)
+        self.by_id = dict((sign['id'], sign) for sign in signatures)
+        self.expires_at = expires_at
 
-    def _post_request(self, request_type, qargs={}, **kwargs):
-        return self._request('post', request_type, qargs, **kwargs)
+    def expired(self):
+        return time.time() >= self.expires_at
 
 
 class _SMSResponse(object):
+    __slots__ = ('_connection', '_status', '_description', '_details')
 
     @staticmethod
-    def from_response(conn, response):
-        data = response.json()
-        for resp in data:
-            yield _SMSResponse(conn, resp['status'], resp['description'])
+    def from_response(conn, data):
+        for status, description in protocol.Protocol.parse_send_multi(data):
+            yield _SMSResponse(conn, status, description)
 
     def __init__(self, conn, status, description):
         self._connection = conn
@@ -246,12 +568,14 @@ class _SMSResponse(object):
 
     def _get_details(self):
         if self._details is None \
-            or self._details['description'] != 'DELIVERED':
+            or self._details['description'] not in TERMINAL_STATES:
             self._details = self._connection.details(self._description)
             if self._details['status'] != 0:
                 raise ConnectionError('Can\'t get details. '
                                       'Nonzero status of bytehand response:' +
                                       self._details['description'])
+            self._details['description'] = intern_state(
+                self._details['description'])
 
     @property
     def is_delivered(self):
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Coalescing of duplicate sends.
+
+    >>> from bytehand import Connection
+    >>> conn = Connection(userid=1342, key='5C3D5D3C2B1C4D8B',
+    ...                   dedup=Deduplicator(window=10))
+
+Identical messages (same "to", "from" and "text") sent within @window
+seconds get the response of the first one instead of being sent again.
+Concurrent identical sends wait for one shared request.
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from future import Future
+
+
+def message_digest(msg):
+    """:returns: sha1 digest of "to", "from" and "text" of @msg.
+
+    Unicode and utf-8 encoded values give the same digest.
+    """
+    return hashlib.sha1('\0'.join(
+        _to_bytes(msg.get(field, '')) for field in ('to', 'from', 'text')
+    )).digest()
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value if isinstance(value, str) else str(value)
+
+
+class Deduplicator(object):
+    """Bounded index of recently sent messages.
+
+    :param window: seconds during which identical message is not sent
+                   again.
+    :param max_entries: max number of remembered messages. The oldest
+                        ones are forgotten first.
+
+    Only successful responses are remembered: message rejected by
+    bytehand is sent again on next call.
+    """
+
+    def __init__(self, window=10, max_entries=10000):
+        self.window = window
+        self.max_entries = max_entries
+        self._index = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def send_multi(self, send, msgs):
+        """Send @msgs with @send skipping recently sent ones.
+
+        :param send: callable taking list of messages and returning list
+                     of responses.
+        :param msgs: list of message dicts.
+
+        :returns: list of responses in order of @msgs.
+        """
+        keys = [message_digest(msg) for msg in msgs]
+        futures = {}
+        own = OrderedDict()
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            for key, msg in zip(keys, msgs):
+                if key in futures:
+                    continue
+                entry = self._index.get(key)
+                if entry is not None:
+                    futures[key] = entry[1]
+                    continue
+                futures[key] = Future()
+                own[key] = msg
+                self._index[key] = (now + self.window, futures[key])
+            while len(self._index) > self.max_entries:
+                self._index.popitem(last=False)
+        if own:
+            self._send(send, own, futures)
+        return [futures[key].result() for key in keys]
+
+    def clear(self):
+        """Forget all sent messages."""
+        with self._lock:
+            self._index.clear()
+
+    def _send(self, send, own, futures):
+        try:
+            responses = send(own.values())
+        except Exception as error:
+            self._forget(own, futures)
+            for key in own:
+                futures[key].set_exception(error)
+            raise
+        failed = [key for key, response in zip(own, responses)
+                  if str(response.status) != '0']
+        self._forget(failed, futures)
+        for key, response in zip(own, responses):
+            futures[key].set_result(response)
+
+    def _forget(self, keys, futures):
+        with self._lock:
+            for key in keys:
+                entry = self._index.get(key)
+                if entry is not None and entry[1] is futures[key]:
+                    del self._index[key]
+
+    def _expire(self, now):
+        index = self._index
+        while index:
+            key, (expires_at, _) = next(index.iteritems())
+            if expires_at > now:
+                return
+            del index[key]
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Deferred and time-windowed sending.
+
+    >>> daytime = DeliveryWindow(start=9, end=21, utc_offset=3)
+    >>> sender = DeferredSender(conn, batch_size=500)  # doctest:+SKIP
+    >>> sender.schedule({'to': '79001234567', 'from': 'shop',  # doctest:+SKIP
+    ...                  'text': 'Sale!'}, at=time.time() + 3600,
+    ...                 key='sale-79001234567', window=daytime)
+    'sale-79001234567'
+    >>> sender.cancel('sale-79001234567')           # doctest:+SKIP
+    True
+    >>> sender.start()                              # doctest:+SKIP
+
+Messages are kept in a heap ordered by due time, message itself is
+stored as compact tuple. Due messages are released in batches through
+`send_multi`, at most `max_rate` messages per second.
+"""
+
+import time
+import heapq
+import logging
+import itertools
+import threading
+
+
+_log = logging.getLogger(__name__)
+
+
+_DAY = 24 * 60 * 60
+
+
+class DeliveryWindow(object):
+    """Daily time interval when messages may be delivered.
+
+    :param start: first allowed hour of day, may be fractional.
+    :param end: first not allowed hour of day. If @end is less than
+                @start, window passes midnight.
+    :param utc_offset: recipient timezone offset in hours.
+    """
+
+    def __init__(self, start, end, utc_offset=0):
+        self.start = int(start * 3600)
+        self.end = int(end * 3600)
+        self.offset = int(utc_offset * 3600)
+
+    def next_allowed(self, timestamp):
+        """:returns: earliest allowed timestamp not before @timestamp."""
+        second = (timestamp + self.offset) % _DAY
+        if self.start <= self.end:
+            if self.start <= second < self.end:
+                return timestamp
+        elif second >= self.start or second < self.end:
+            return timestamp
+        wait = self.start - second
+        if wait < 0:
+            wait += _DAY
+        return timestamp + wait
+
+
+class DeferredSender(object):
+    """Hold messages until their due time and send them by batches.
+
+    :param conn: `Connection` to send messages with.
+    :param batch_size: max number of messages in one request.
+    :param max_rate: max messages per second, None for no limit. With
+                     limit batches are cut to `max_rate * tick`
+                     messages and spread evenly.
+    :param tick: seconds between rate limited batches.
+    :param on_sent: callable called with (key, response) for sent
+                    messages.
+    :param on_error: callable called with (keys, error) for failed
+                     batches. Failed messages are not rescheduled.
+                     Without it `release` raises the error, background
+                     thread logs it and goes on.
+    """
+
+    def __init__(self, conn, batch_size=500, max_rate=None, tick=0.1,
+                 on_sent=None, on_error=None):
+        self._connection = conn
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.tick = tick
+        self.on_sent = on_sent
+        self.on_error = on_error
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        """Number of scheduled messages."""
+        return len(self._entries)
+
+    def schedule(self, msg, at, key=None, window=None):
+        """Schedule @msg for sending at @at.
+
+        :param msg: dict in `send_multi` format.
+        :param at: unix timestamp.
+        :param key: key to cancel message by. Scheduling message with
+                    key of already scheduled one replaces it.
+        :param window: `DeliveryWindow`, message is delayed until window
+                       opens.
+
+        :returns: key of scheduled message.
+        """
+        if window is not None:
+            at = window.next_allowed(at)
+        seq = next(self._counter)
+        if key is None:
+            key = seq
+        with self._condition:
+            self._entries[key] = (seq, msg['to'], msg['from'], msg['text'])
+            heapq.heappush(self._heap, (at, seq, key))
+            if self._heap[0][1] == seq:
+                self._condition.notify()
+        return key
+
+    def cancel(self, key):
+        """Cancel scheduled message.
+
+        :returns: True if message was scheduled.
+        """
+        with self._condition:
+            return self._entries.pop(key, None) is not None
+
+    def next_due(self):
+        """:returns: due timestamp of the earliest message or None."""
+        with self._condition:
+            self._drop_cancelled()
+            return self._heap[0][0] if self._heap else None
+
+    def release(self, now=None):
+        """Send all messages due at @now.
+
+        :returns: number of sent messages.
+        """
+        now = time.time() if now is None else now
+        sent = 0
+        while True:
+            batch = self._take(now)
+            if not batch:
+                return sent
+            self._send(batch)
+            sent += len(batch)
+
+    def start(self):
+        """Release due messages in background thread."""
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop background thread. Scheduled messages are kept."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                self._drop_cancelled()
+                wait = None if not self._heap \
+                    else self._heap[0][0] - time.time()
+                if wait is None or wait > 0:
+                    self._condition.wait(wait)
+                    continue
+            batch = self._take(time.time())
+            if not batch:
+                continue
+            try:
+                self._send(batch)
+            except Exception:
+                _log.exception('Failed to send %d deferred messages',
+                               len(batch))
+
+    def _drop_cancelled(self):
+        heap = self._heap
+        while heap:
+            entry = self._entries.get(heap[0][2])
+            if entry is not None and entry[0] == heap[0][1]:
+                return
+            heapq.heappop(heap)
+
+    def _take(self, now):
+        batch = []
+        size = self.batch_size
+        if self.max_rate:
+            size = max(1, min(size, int(self.max_rate * self.tick)))
+        with self._condition:
+            heap = self._heap
+            while heap and len(batch) < size:
+                self._drop_cancelled()
+                if not heap or heap[0][0] > now:
+                    break
+                _, _, key = heapq.heappop(heap)
+                batch.append((key, self._entries.pop(key)))
+        return batch
+
+    def _send(self, batch):
+        started = time.time()
+        keys = [key for key, _ in batch]
+        msgs = [{'to': to, 'from': signature, 'text': text}
+                for _, (_, to, signature, text) in batch]
+        try:
+            responses = self._connection.send_multi(msgs)
+        except Exception as error:
+            if self.on_error is None:
+                raise
+            self.on_error(keys, error)
+        else:
+            if self.on_sent is not None:
+                for key, response in zip(keys, responses):
+                    self.on_sent(key, response)
+        finally:
+            if self.max_rate:
+                time.sleep(max(0, len(batch) / float(self.max_rate) -
+                               (time.time() - started)))
@@ -1,3 +1,28 @@
 # -*- coding: utf-8 -*-
 
 API_URL = 'https://bytehand.com:8443'
+
+# Max number of messages sent in one `send_multi` request by bulk sending.
+SEND_MULTI_CHUNK_SIZE = 500
+
+# Responses of `send_multi` requests with at least this number of
+# messages and other json arrays bigger than this number of bytes are
+# decoded incrementally.
+STREAM_DECODE_MESSAGES = 1000
+STREAM_DECODE_BYTES = 64 * 1024
+
+# Delivery states after which message state never changes.
+TERMINAL_STATES = frozenset(['DELIVERED', 'EXPIRED', 'UNDELIVERABLE',
+                             'REJECTED', 'DELETED'])
+
+# All message delivery states. Index of state is its compact code.
+DELIVERY_STATES = ('NEW', 'DELIVERED', 'EXPIRED', 'DELETED',
+                   'UNDELIVERABLE', 'ACCEPTED', 'UNKNOWN', 'REJECTED')
+
+STATE_CODES = dict((state, code) for code, state in enumerate(DELIVERY_STATES))
+
+
+def intern_state(state):
+    """:returns: shared instance of given delivery @state string."""
+    code = STATE_CODES.get(state)
+    return state if code is None else DELIVERY_STATES[code]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Minimal thread safe future used by non-blocking bytehand api.
+"""
+
+import threading
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class Future(object):
+    """Result of operation which may be not finished yet."""
+
+    def __init__(self):
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        """Check is operation finished."""
+        return self._finished.is_set()
+
+    def result(self, timeout=None):
+        """Wait for operation and return its result.
+
+        :param timeout: seconds to wait, None means wait forever.
+
+        :raises TimeoutError: if operation isn't finished in @timeout.
+        :raises: exception of failed operation.
+        """
+        self._wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for operation and return its exception or None."""
+        self._wait(timeout)
+        return self._error
+
+    def add_done_callback(self, callback):
+        """Call @callback with this future when operation is finished."""
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, error):
+        self._error = error
+        self._finish()
+
+    def _wait(self, timeout):
+        if not self._finished.wait(timeout):
+            raise TimeoutError('Operation is not finished '
+                               'in {0} seconds'.format(timeout))
+
+    def _finish(self):
+        with self._lock:
+            self._finished.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""Sending through several bytehand accounts.
+
+    >>> from bytehand import Connection
+    >>> group = ConnectionGroup([Connection(userid=1, key='KEY1'),
+    ...                          Connection(userid=2, key='KEY2')],
+    ...                         weights=[3, 1])
+    >>> responses = group.send_bulk(msgs)           # doctest:+SKIP
+    >>> group.details(responses[0].description)     # doctest:+SKIP
+
+Batches are spread between accounts by weight, by remaining balance or
+by observed latency. Batch failed with 429 or 5xx status or with failed
+connection is sent through another account. Account failing
+`max_errors` times in a row is not used for `cooldown` seconds.
+"""
+
+import time
+import threading
+
+import bulk
+from balance import BalanceMonitor
+from connection import HTTPError
+from retry import is_connect_error
+from parts import Tariff, count_parts
+from definitions import SEND_MULTI_CHUNK_SIZE
+
+
+WEIGHT = 'weight'
+BALANCE = 'balance'
+LATENCY = 'latency'
+
+# Weight of the last request in latency moving average.
+_LATENCY_ALPHA = 0.2
+
+
+class AccountStats(object):
+    """Sending statistics of one account."""
+    __slots__ = ('requests', 'messages', 'errors', 'consecutive_errors',
+                 'latency', 'disabled_until')
+
+    def __init__(self):
+        self.requests = 0
+        self.messages = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.latency = None
+        self.disabled_until = 0
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class ConnectionGroup(object):
+    """Group of connections to different accounts.
+
+    :param connections: list of `Connection`.
+    :param weights: relative share of batches for each connection,
+                    used by 'weight' strategy. Equal by default.
+    :param strategy: 'weight', 'balance' (account with the most money)
+                     or 'latency' (the fastest account).
+    :param max_errors: number of failed requests in a row after which
+                       account is disabled.
+    :param cooldown: seconds account stays disabled.
+    :param balance_ttl: seconds to cache balances for 'balance' strategy.
+    :param tariff: `bytehand.parts.Tariff` to estimate cost of sent
+                   batches with between balance requests of 'balance'
+                   strategy. By default every part costs 1, it is only
+                   used to rank accounts.
+    """
+
+    def __init__(self, connections, weights=None, strategy=WEIGHT,
+                 max_errors=3, cooldown=60, balance_ttl=60, tariff=None):
+        if not connections:
+            raise ValueError('At least one connection is required')
+        if strategy not in (WEIGHT, BALANCE, LATENCY):
+            raise ValueError('Unknown strategy: {0}'.format(strategy))
+        self.connections = list(connections)
+        self.weights = list(weights) if weights is not None \
+            else [1] * len(self.connections)
+        if len(self.weights) != len(self.connections):
+            raise ValueError('Number of weights must match number '
+                             'of connections')
+        self.strategy = strategy
+        self.max_errors = max_errors
+        self.cooldown = cooldown
+        self._stats = [AccountStats() for _ in self.connections]
+        self._current = [0] * len(self.connections)
+        self._routes = {}
+        self._lock = threading.Lock()
+        self.tariff = tariff if tariff is not None else Tariff(1)
+        self._monitors = None
+        if strategy == BALANCE:
+            self._monitors = [BalanceMonitor(conn, ttl=balance_ttl)
+                              for conn in self.connections]
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        for monitor in self._monitors or ():
+            monitor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def send(self, to=None, signature=None, text=None):
+        """:see: `Connection.send`"""
+        msg = {'to': str(to),
+               'from': str(signature),
+               'text': text}
+        return self.send_multi([msg])[0]
+
+    def send_multi(self, msgs):
+        """Send @msgs through one of available accounts.
+
+        If account fails with 429 or 5xx http status or can't be
+        connected, batch is sent through the next available account.
+        Other errors are raised at once.
+
+        :see: `Connection.send_multi`
+        """
+        tried = set()
+        while True:
+            index = self._choose(tried)
+            tried.add(index)
+            started = time.time()
+            try:
+                responses = self.connections[index].send_multi(msgs)
+            except HTTPError as error:
+                if error.status_code != 429 and error.status_code < 500:
+                    raise
+                self._record_error(index)
+                if len(tried) == len(self.connections):
+                    raise
+                continue
+            except Exception as error:
+                self._record_error(index)
+                if not is_connect_error(error) or \
+                        len(tried) == len(self.connections):
+                    raise
+                continue
+            self._record_success(index, msgs, responses,
+                                 time.time() - started)
+            if self._monitors is not None:
+                self._charge(index, msgs, responses)
+            return responses
+
+    def send_bulk(self, msgs, chunk_size=SEND_MULTI_CHUNK_SIZE, workers=4):
+        """:see: `Connection.send_bulk`"""
+        return bulk.send_bulk(self, msgs, chunk_size=chunk_size,
+                              workers=workers)
+
+    def send_stream(self, msgs, chunk_size=SEND_MULTI_CHUNK_SIZE, workers=4,
+                    on_error=None):
+        """:see: `Connection.send_stream`"""
+        return bulk.send_stream(self, msgs, chunk_size=chunk_size,
+                                workers=workers, on_error=on_error)
+
+    def connection_for(self, msgid):
+        """:returns: `Connection` message @msgid was sent by.
+
+        :raises LookupError: if message wasn't sent through this group.
+        """
+        try:
+            return self.connections[self._routes[str(msgid)]]
+        except KeyError:
+            raise LookupError('Unknown message id: {0}'.format(msgid))
+
+    def details(self, msgid):
+        """:see: `Connection.details`"""
+        return self.connection_for(msgid).details(msgid)
+
+    def stats(self):
+        """:returns: list of per account statistics dicts, with userid."""
+        with self._lock:
+            result = []
+            for conn, stats in zip(self.connections, self._stats):
+                account = stats.as_dict()
+                account['userid'] = conn.userid
+                result.append(account)
+        return result
+
+    def _available(self, tried):
+        now = time.time()
+        available = [index for index, stats in enumerate(self._stats)
+                     if index not in tried and stats.disabled_until <= now]
+        if not available:
+            # All accounts are cooling down: use one recovering first.
+            left = [index for index in xrange(len(self.connections))
+                    if index not in tried]
+            available = [min(left,
+                             key=lambda i: self._stats[i].disabled_until)]
+        return available
+
+    def _choose(self, tried):
+        with self._lock:
+            available = self._available(tried)
+            if len(available) == 1:
+                return available[0]
+            if self.strategy == LATENCY:
+                return min(available,
+                           key=lambda i: self._stats[i].latency or 0)
+            if self.strategy == WEIGHT:
+                total = 0
+                for index in available:
+                    self._current[index] += self.weights[index]
+                    total += self.weights[index]
+                chosen = max(available, key=lambda i: self._current[i])
+                self._current[chosen] -= total
+                return chosen
+        return max(available, key=self._balance)
+
+    def _balance(self, index):
+        try:
+            return self._monitors[index].estimate()
+        except Exception:
+            self._record_error(index)
+            return float('-inf')
+
+    def _charge(self, index, msgs, responses):
+        """Subtract estimated cost of sent @msgs from cached balance
+        until its next request.
+        """
+        monitor = self._monitors[index]
+        for msg, response in zip(msgs, responses):
+            if str(response.status) == '0':
+                monitor.record_cost(response.description,
+                                    self.tariff.price_for(msg['to']) *
+                                    count_parts(msg['text']))
+
+    def _record_error(self, index):
+        with self._lock:
+            stats = self._stats[index]
+            stats.requests += 1
+            stats.errors += 1
+            stats.consecutive_errors += 1
+            if stats.consecutive_errors >= self.max_errors:
+                stats.disabled_until = time.time() + self.cooldown
+                stats.consecutive_errors = 0
+
+    def _record_success(self, index, msgs, responses, latency):
+        with self._lock:
+            stats = self._stats[index]
+            stats.requests += 1
+            stats.messages += len(msgs)
+            stats.consecutive_errors = 0
+            stats.latency = latency if stats.latency is None else \
+                stats.latency + _LATENCY_ALPHA * (latency - stats.latency)
+            for response in responses:
+                if str(response.status) == '0':
+                    self._routes[str(response.description)] = index
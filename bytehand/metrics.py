@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Instrumentation of bytehand requests.
+
+    >>> collector = MetricsCollector()
+    >>> conn.add_instrument(collector)              # doctest:+SKIP
+    >>> conn.balance()                              # doctest:+SKIP
+    >>> print prometheus_text(collector)            # doctest:+SKIP
+    bytehand_requests_total{endpoint="balance",method="get",...} 1
+
+Every request produces `RequestEvent`. Any callable accepting event may
+be added as instrument, e.g. `StatsdExporter`.
+
+Latency is split in `response_time` (until response headers are
+received) and `transfer_time` (reading response body). `requests`
+doesn't expose DNS, connect and TLS timings separately, they are part
+of `response_time` of requests opening new connections.
+"""
+
+import bisect
+import socket
+import threading
+import timeit
+
+
+OK = 'ok'
+HTTP_ERROR = 'http_error'
+ERROR = 'error'
+
+# Upper bounds of latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0)
+
+_clock = timeit.default_timer
+
+
+class RequestEvent(object):
+    """Timing and outcome of one http request to bytehand.
+
+    :param method: http method.
+    :param endpoint: api method, e.g. 'send_multi'.
+    :param attempt: attempt number, greater than 1 for retries.
+    :param batch_size: number of sent messages or None.
+    :param data: request body.
+    """
+    __slots__ = ('method', 'endpoint', 'attempt', 'batch_size', 'started',
+                 'elapsed', 'response_time', 'bytes_sent', 'bytes_received',
+                 'status_code', 'outcome', 'error')
+
+    def __init__(self, method, endpoint, attempt=1, batch_size=None,
+                 data=None):
+        self.method = method
+        self.endpoint = endpoint
+        self.attempt = attempt
+        self.batch_size = batch_size
+        self.bytes_sent = len(data) if isinstance(data, basestring) else 0
+        self.bytes_received = 0
+        self.status_code = None
+        self.response_time = None
+        self.elapsed = None
+        self.outcome = None
+        self.error = None
+        self.started = _clock()
+
+    @property
+    def transfer_time(self):
+        """Seconds spent reading response body, None if unknown."""
+        if self.response_time is None or self.elapsed is None:
+            return None
+        return max(0.0, self.elapsed - self.response_time)
+
+    def finished(self, response, bytes_received=None):
+        """Fill event from `requests.Response` which body is read.
+
+        :param bytes_received: length of body read by chunks, by default
+                               it is taken from the response.
+        """
+        self.elapsed = _clock() - self.started
+        self.status_code = response.status_code
+        if response.elapsed is not None:
+            self.response_time = response.elapsed.total_seconds()
+        if bytes_received is not None:
+            self.bytes_received = bytes_received
+        else:
+            length = response.headers.get('Content-Length')
+            self.bytes_received = int(length) if length is not None \
+                else len(response.content or '')
+        self.outcome = OK if response.ok else HTTP_ERROR
+        return self
+
+    def failed(self, error):
+        """Fill event for request failed with @error."""
+        self.elapsed = _clock() - self.started
+        self.outcome = ERROR
+        self.error = error
+        return self
+
+
+class Histogram(object):
+    """Cumulative histogram with fixed buckets.
+
+    :param buckets: sorted upper bounds of buckets.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """:returns: list of (upper bound, count), last bound is inf."""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),),
+                                self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """:returns: upper bound of bucket containing @q quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class MetricsCollector(object):
+    """In-process aggregation of request events. Use as instrument."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.bytes_sent = {}
+        self.bytes_received = {}
+        self.messages = {}
+        self.retries = {}
+
+    def __call__(self, event):
+        self.observe(event)
+
+    def observe(self, event):
+        key = (event.method, event.endpoint)
+        with self._lock:
+            outcome_key = key + (event.outcome,)
+            self.requests[outcome_key] = self.requests.get(outcome_key, 0) + 1
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(self._buckets)
+            histogram.observe(event.elapsed)
+            self.bytes_sent[key] = \
+                self.bytes_sent.get(key, 0) + event.bytes_sent
+            self.bytes_received[key] = \
+                self.bytes_received.get(key, 0) + event.bytes_received
+            if event.batch_size:
+                self.messages[key] = \
+                    self.messages.get(key, 0) + event.batch_size
+            if event.attempt > 1:
+                self.retries[key] = self.retries.get(key, 0) + 1
+
+
+def _labels(**labels):
+    return '{' + ','.join('{0}="{1}"'.format(name, labels[name])
+                          for name in sorted(labels)) + '}'
+
+
+def prometheus_text(collector, prefix='bytehand'):
+    """:returns: metrics of @collector in Prometheus text format."""
+    lines = []
+
+    def counter(name, help_text, values, with_outcome=False):
+        lines.append('# HELP {0}_{1} {2}'.format(prefix, name, help_text))
+        lines.append('# TYPE {0}_{1} counter'.format(prefix, name))
+        for key, value in sorted(values.items()):
+            labels = dict(method=key[0], endpoint=key[1])
+            if with_outcome:
+                labels['outcome'] = key[2]
+            lines.append('{0}_{1}{2} {3}'.format(prefix, name,
+                                                 _labels(**labels), value))
+
+    with collector._lock:
+        counter('requests_total', 'Http requests to bytehand.',
+                collector.requests, with_outcome=True)
+        counter('retries_total', 'Retried http requests.',
+                collector.retries)
+        counter('messages_total', 'Messages sent in requests.',
+                collector.messages)
+        counter('sent_bytes_total', 'Request body bytes.',
+                collector.bytes_sent)
+        counter('received_bytes_total', 'Response body bytes.',
+                collector.bytes_received)
+        name = prefix + '_request_duration_seconds'
+        lines.append('# HELP {0} Http request latency.'.format(name))
+        lines.append('# TYPE {0} histogram'.format(name))
+        for (method, endpoint), histogram in sorted(
+                collector.latency.items()):
+            for bound, total in histogram.cumulative():
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, _labels(method=method, endpoint=endpoint,
+                                  le='+Inf' if bound == float('inf')
+                                  else repr(bound)), total))
+            labels = _labels(method=method, endpoint=endpoint)
+            lines.append('{0}_sum{1} {2!r}'.format(name, labels,
+                                                   histogram.sum))
+            lines.append('{0}_count{1} {2}'.format(name, labels,
+                                                   histogram.count))
+    return '\n'.join(lines) + '\n'
+
+
+class StatsdExporter(object):
+    """Instrument sending every event to StatsD over UDP.
+
+    :param host: StatsD host.
+    :param port: StatsD port.
+    :param prefix: metric names prefix.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='bytehand'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, event):
+        self.send(self.format(event))
+
+    def format(self, event):
+        """:returns: StatsD lines for @event."""
+        name = '{0}.{1}'.format(self.prefix, event.endpoint)
+        lines = ['{0}.requests.{1}:1|c'.format(name, event.outcome),
+                 '{0}.latency:{1:.3f}|ms'.format(name, event.elapsed * 1000),
+                 '{0}.sent_bytes:{1}|c'.format(name, event.bytes_sent),
+                 '{0}.received_bytes:{1}|c'.format(name,
+                                                   event.bytes_received)]
+        if event.batch_size:
+            lines.append('{0}.messages:{1}|c'.format(name, event.batch_size))
+        if event.attempt > 1:
+            lines.append('{0}.retries:1|c'.format(name))
+        return '\n'.join(lines)
+
+    def send(self, payload):
+        try:
+            self._socket.sendto(payload, self.address)
+        except socket.error:
+            pass
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Durable local outbox for crash-safe sending.
+
+Messages are stored in SQLite file before they are sent, and marked
+with sending result after:
+    >>> outbox = Outbox('/var/lib/app/outbox.db')   # doctest:+SKIP
+    >>> outbox.put(msgs)                            # doctest:+SKIP
+    >>> outbox.send_pending(conn)                   # doctest:+SKIP
+
+After crash open the same file and call `send_pending` again: only
+messages without results are sent. Messages which were being sent at
+the moment of crash or network failure are in unknown state,
+see `recover`.
+
+Every `put` and every sent batch is one transaction, so disk is synced
+once per batch, not per message.
+"""
+
+import json
+import sqlite3
+import threading
+
+from connection import HTTPError
+
+PENDING = 0
+IN_FLIGHT = 1
+SENT = 2
+FAILED = 3
+UNCERTAIN = 4
+
+_STATE_NAMES = {PENDING: 'pending', IN_FLIGHT: 'in_flight', SENT: 'sent',
+                FAILED: 'failed', UNCERTAIN: 'uncertain'}
+
+
+class Outbox(object):
+    """Messages queue stored in SQLite database.
+
+    :param path: database file path.
+    :param synchronous: SQLite `synchronous` pragma. 'NORMAL' survives
+                        process crash, 'FULL' survives power loss too.
+    """
+
+    def __init__(self, path, synchronous='NORMAL'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous={0}'.format(synchronous))
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' payload TEXT NOT NULL,'
+                ' state INTEGER NOT NULL,'
+                ' status TEXT,'
+                ' description TEXT)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS messages_state '
+                             'ON messages (state, id)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def put(self, msgs):
+        """Store @msgs for sending in one transaction.
+
+        :param msgs: iterable of dicts in `send_multi` format.
+
+        :returns: number of stored messages.
+        """
+        rows = [(json.dumps(msg), PENDING) for msg in msgs]
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT INTO messages (payload, state) VALUES (?, ?)', rows)
+        return len(rows)
+
+    def send_pending(self, conn, batch_size=500, limit=None):
+        """Send stored messages which were not sent yet.
+
+        :param conn: `Connection` to send messages with.
+        :param batch_size: max number of messages in one request.
+        :param limit: max number of messages to send, None means all.
+
+        :returns: number of sent messages.
+
+        :note: if request fails without http response or with 5xx
+               status, batch stays in flight: it may be sent or not,
+               proxy could fail after gateway sent it. See `recover`.
+        """
+        sent = 0
+        while limit is None or sent < limit:
+            size = batch_size if limit is None \
+                else min(batch_size, limit - sent)
+            batch = self._take(size)
+            if not batch:
+                break
+            ids = [row_id for row_id, _ in batch]
+            try:
+                responses = conn.send_multi([msg for _, msg in batch])
+            except HTTPError as error:
+                if error.status_code is not None and \
+                        400 <= error.status_code < 500:
+                    # Gateway rejected the request, nothing was sent.
+                    self._set_state(ids, PENDING)
+                raise
+            self._mark(ids, responses)
+            sent += len(batch)
+        return sent
+
+    def recover(self, resend=False):
+        """Handle messages which were being sent during crash.
+
+        :param resend: put them back to pending. Recipients may get such
+                       messages twice. Otherwise they are marked as
+                       uncertain.
+
+        :returns: number of recovered messages.
+        """
+        state = PENDING if resend else UNCERTAIN
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'UPDATE messages SET state = ? WHERE state = ?',
+                (state, IN_FLIGHT))
+            return cursor.rowcount
+
+    def counts(self):
+        """:returns: dict with number of messages in each state."""
+        counts = dict((name, 0) for name in _STATE_NAMES.itervalues())
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT state, COUNT(*) FROM messages GROUP BY state')
+            for state, count in rows:
+                counts[_STATE_NAMES[state]] = count
+        return counts
+
+    def results(self):
+        """Yield (msg, state, status, description) of stored messages.
+
+        `description` is message id for successfully sent messages.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT payload, state, status, description '
+                'FROM messages ORDER BY id').fetchall()
+        for payload, state, status, description in rows:
+            yield json.loads(payload), _STATE_NAMES[state], status, description
+
+    def _take(self, size):
+        with self._lock, self._db:
+            rows = self._db.execute(
+                'SELECT id, payload FROM messages WHERE state = ? '
+                'ORDER BY id LIMIT ?', (PENDING, size)).fetchall()
+            self._db.executemany(
+                'UPDATE messages SET state = ? WHERE id = ?',
+                [(IN_FLIGHT, row_id) for row_id, _ in rows])
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def _set_state(self, ids, state):
+        with self._lock, self._db:
+            self._db.executemany(
+                'UPDATE messages SET state = ? WHERE id = ?',
+                [(state, row_id) for row_id in ids])
+
+    def _mark(self, ids, responses):
+        rows = [(SENT if str(resp.status) == '0' else FAILED,
+                 str(resp.status), resp.description, row_id)
+                for row_id, resp in zip(ids, responses)]
+        with self._lock, self._db:
+            self._db.executemany(
+                'UPDATE messages SET state = ?, status = ?, description = ? '
+                'WHERE id = ?', rows)
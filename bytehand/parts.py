@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Sms segmentation and cost estimation.
+
+    >>> count_parts(u'Hello!')
+    1
+    >>> count_parts(u'Hello!' * 30)
+    2
+    >>> count_parts(u'\u041f\u0440\u0438\u0432\u0435\u0442!' * 12)
+    2
+    >>> tariff = Tariff('0.35', prefixes={'7': '0.30'})
+    >>> estimate([{'to': '79001234567', 'from': 'me', 'text': u'Hi!'}],
+    ...          tariff).cost
+    Decimal('0.30')
+
+Texts consisting of GSM 03.38 characters are sent in 7-bit encoding:
+160 septets in single sms, 153 septets per part of concatenated one.
+Characters from extension table take 2 septets. Other texts are sent
+in UCS-2: 70 characters in single sms, 67 per part.
+"""
+
+import re
+import collections
+from decimal import Decimal
+
+
+GSM7_BASIC = frozenset(
+    u'@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+    u'¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà'
+)
+GSM7_EXTENSION = frozenset(u'\x0c^{}\\[~]|€')
+
+GSM7_SINGLE = 160
+GSM7_PART = 153
+UCS2_SINGLE = 70
+UCS2_PART = 67
+
+_CACHE_SIZE = 65536
+_cache = {}
+
+
+def _to_unicode(text):
+    return text if isinstance(text, unicode) else text.decode('utf-8')
+
+
+GSM7 = GSM7_BASIC | GSM7_EXTENSION
+
+_NOT_GSM7_RE = re.compile(
+    u'[^{0}]'.format(re.escape(u''.join(GSM7))), re.UNICODE)
+_GSM7_EXTENSION_RE = re.compile(
+    u'[{0}]'.format(re.escape(u''.join(GSM7_EXTENSION))), re.UNICODE)
+_NOT_BMP_RE = re.compile(u'[\ud800-\udfff]|[^\u0000-\uffff]'
+                         if len(u'\U0001F600') == 1 else u'[\ud800-\udfff]',
+                         re.UNICODE)
+
+
+def _gsm7_widths(text):
+    """:returns: list of septet widths of @text characters."""
+    return [2 if char in GSM7_EXTENSION else 1 for char in text]
+
+
+def _ucs2_widths(text):
+    """:returns: list of UTF-16 code units of @text characters.
+
+    Surrogate pair takes two units and is never split between parts.
+    """
+    widths = []
+    for char in text:
+        if len(char) == 1 and ord(char) > 0xffff:
+            widths.append(2)
+        elif u'\ud800' <= char <= u'\udbff':
+            # High surrogate on narrow build: low one is counted with it.
+            widths.append(2)
+        elif not u'\udc00' <= char <= u'\udfff':
+            widths.append(1)
+    return widths
+
+
+def _split(widths, part):
+    """Count parts of @part width needed for characters of @widths."""
+    parts = 1
+    used = 0
+    for width in widths:
+        if used + width > part:
+            parts += 1
+            used = 0
+        used += width
+    return parts
+
+
+def _count_parts(text):
+    if _NOT_GSM7_RE.search(text) is None:
+        septets = len(text)
+        extension = len(_GSM7_EXTENSION_RE.findall(text))
+        if septets + extension <= GSM7_SINGLE:
+            return 1
+        if not extension:
+            return -(-septets // GSM7_PART)
+        return _split(_gsm7_widths(text), GSM7_PART)
+    if len(text) <= UCS2_SINGLE // 2:
+        return 1
+    if _NOT_BMP_RE.search(text) is not None:
+        widths = _ucs2_widths(text)
+        if sum(widths) <= UCS2_SINGLE:
+            return 1
+        return _split(widths, UCS2_PART)
+    if len(text) <= UCS2_SINGLE:
+        return 1
+    return -(-len(text) // UCS2_PART)
+
+
+def count_parts(text):
+    """:returns: number of sms parts needed to send @text.
+
+    :param text: unicode or utf-8 encoded str.
+    """
+    try:
+        return _cache[text]
+    except KeyError:
+        pass
+    parts = _count_parts(_to_unicode(text))
+    if len(_cache) >= _CACHE_SIZE:
+        _cache.clear()
+    _cache[text] = parts
+    return parts
+
+
+def is_gsm7(text):
+    """Check is @text can be sent in 7-bit encoding."""
+    return _NOT_GSM7_RE.search(_to_unicode(text)) is None
+
+
+class Tariff(object):
+    """Price of one sms part.
+
+    :param price: default price of part in rubles.
+    :param prefixes: dict of phone number prefix to price. The longest
+                     matching prefix is used.
+    """
+
+    def __init__(self, price, prefixes=None):
+        self.price = Decimal(str(price))
+        self.prefixes = dict((str(prefix), Decimal(str(value)))
+                             for prefix, value in (prefixes or {}).items())
+        self._lengths = sorted(set(len(p) for p in self.prefixes),
+                               reverse=True)
+
+    def price_for(self, to):
+        """:returns: Decimal, price of one part sent to @to."""
+        to = str(to)
+        for length in self._lengths:
+            price = self.prefixes.get(to[:length])
+            if price is not None:
+                return price
+        return self.price
+
+
+Estimate = collections.namedtuple('Estimate', 'messages parts cost')
+
+
+def estimate(msgs, tariff):
+    """Estimate cost of sending @msgs.
+
+    :param msgs: iterable of dicts in `send_multi` format.
+    :param tariff: `Tariff`.
+
+    :returns: `Estimate(messages, parts, cost)`, cost is Decimal.
+    """
+    messages = 0
+    parts_by_price = {}
+    for msg in msgs:
+        messages += 1
+        price = tariff.price_for(msg['to'])
+        parts_by_price[price] = parts_by_price.get(price, 0) + \
+            count_parts(msg['text'])
+    cost = sum((price * parts for price, parts in parts_by_price.items()),
+               Decimal(0))
+    return Estimate(messages, sum(parts_by_price.values()), cost)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Bytehand api protocol without any I/O.
+
+`Protocol` builds requests and parses response bodies, any transport
+may send them:
+
+    >>> proto = Protocol(userid=1342, key='5C3D5D3C2B1C4D8B')
+    >>> request = proto.balance()
+    >>> request.method, request.url
+    ('get', 'https://bytehand.com:8443/balance?id=1342&key=5C3D5D3C2B1C4D8B')
+    >>> proto.check_status(proto.loads('{"status": 0, "description": "1"}'))
+    {u'status': 0, u'description': u'1'}
+
+Base urls and auth query string are computed once per protocol.
+"""
+
+import urlparse
+import collections
+
+import serializer as serializers
+from definitions import API_URL
+
+
+class ConnectionError(Exception):
+    pass
+
+
+class HTTPError(ConnectionError):
+    """Bytehand responded with non-OK http status.
+
+    :param status_code: http status of response.
+    :param url: requested url.
+    """
+
+    def __init__(self, message, status_code=None, url=None):
+        super(HTTPError, self).__init__(message)
+        self.status_code = status_code
+        self.url = url
+
+
+Request = collections.namedtuple(
+    'Request', 'method request_type url body headers batch_size')
+
+JSON_HEADERS = {'Content-Type': 'application/json;charset=UTF-8'}
+
+REQUEST_TYPES = ('send_multi', 'details', 'balance', 'signatures',
+                 'signature')
+
+SIGNATURE_STATES = ('NEW', 'ACCEPTED', 'REJECTED')
+
+
+class Protocol(object):
+    """Request builder and response parser of bytehand api.
+
+    :param userid: Your bytehand api id.
+    :param key: Your bytehand api key.
+    :param api_url: bytehand api url, `API_URL` by default. Its path is
+                    kept as prefix of request paths.
+    :param serializer: `bytehand.serializer.Serializer`, the fastest
+                       installed json library is used by default.
+    """
+
+    def __init__(self, userid, key, api_url=None, serializer=None):
+        from urllib import urlencode
+        self.userid = userid
+        self.key = key
+        self.serializer = serializer if serializer is not None \
+            else serializers.get_serializer()
+        parsed = urlparse.urlparse(api_url or API_URL)
+        prefix = parsed.path.rstrip('/')
+        self._urls = dict(
+            (request_type, parsed._replace(path=prefix + '/' + request_type,
+                                           query='').geturl())
+            for request_type in REQUEST_TYPES
+        )
+        self._auth = urlencode([('id', userid), ('key', key)])
+
+    def url(self, request_type, **qargs):
+        """:returns: url of @request_type request with auth and @qargs
+        query arguments.
+        """
+        url = self._urls[request_type] + '?' + self._auth
+        if qargs:
+            from urllib import urlencode
+            url += '&' + urlencode(qargs)
+        return url
+
+    def send_multi(self, msgs):
+        """:returns: `Request` sending @msgs list of message dicts."""
+        return self.send_encoded(self.serializer.encode_messages(msgs),
+                                 len(msgs))
+
+    def send_encoded(self, data, count):
+        """:returns: `Request` sending json encoded list of @count
+        messages.
+        """
+        return Request('post', 'send_multi', self.url('send_multi'), data,
+                       JSON_HEADERS, count)
+
+    def details(self, msgid):
+        return Request('get', 'details', self.url('details', message=msgid),
+                       None, None, None)
+
+    def balance(self):
+        return Request('get', 'balance', self.url('balance'),
+                       None, None, None)
+
+    def signatures(self, state=None):
+        """:raises ValueError: if @state is not one of
+        `SIGNATURE_STATES`, case insensitive.
+        """
+        if state is None:
+            url = self.url('signatures')
+        elif state.upper() in SIGNATURE_STATES:
+            url = self.url('signatures', state=state.upper())
+        else:
+            raise ValueError('Bad `state` value: "{}"'.format(state))
+        return Request('get', 'signatures', url, None, None, None)
+
+    def new_signature(self, signature, description):
+        return Request('post', 'signature',
+                       self.url('signature', text=signature),
+                       {'description': description}, None, None)
+
+    def delete_signature(self, signature_id):
+        return Request('delete', 'signature',
+                       self.url('signature', signature=signature_id),
+                       None, None, None)
+
+    def loads(self, content):
+        """Decode json response body."""
+        return self.serializer.loads(content)
+
+    def check_http(self, request, status_code):
+        """:raises HTTPError: if @status_code is not OK."""
+        if status_code >= 400:
+            raise HTTPError('Http response error. '
+                            'Status = {}. '.format(status_code) +
+                            'Url = "{}". '.format(request.url) +
+                            'POST data: {}'.format(request.body),
+                            status_code=status_code, url=request.url)
+
+    def check_status(self, data):
+        """:raises ConnectionError: if @data has nonzero status.
+
+        :returns: @data
+        """
+        if int(data['status']) != 0:
+            raise ConnectionError(
+                'Nonzero status: {0}\n'.format(data['status']) +
+                'Description: {0}'.format(data['description'])
+            )
+        return data
+
+    @staticmethod
+    def parse_send_multi(data):
+        """:returns: iterator of (status, description) pairs from
+        decoded `send_multi` response @data.
+        """
+        for item in data:
+            yield item['status'], item['description']
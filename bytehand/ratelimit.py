@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Client-side rate limiting of bytehand requests.
+
+    >>> from bytehand import Connection
+    >>> limiter = RateLimiter(messages_per_second=50,
+    ...                       requests_per_second=5)
+    >>> conn = Connection(userid=1342, key='5C3D5D3C2B1C4D8B',
+    ...                   rate_limiter=limiter)
+
+To share limits between processes on one host store buckets in files:
+    >>> limiter = RateLimiter(messages_per_second=50,
+    ...                       path='/tmp/bytehand.limit')  # doctest:+SKIP
+"""
+
+import os
+import time
+import fcntl
+import threading
+
+
+class TokenBucket(object):
+    """Thread safe token bucket.
+
+    :param rate: tokens added per second.
+    :param capacity: max number of tokens, i.e. allowed burst.
+
+    Acquiring more tokens than available puts bucket in debt: caller
+    waits until debt is paid, so big batches are allowed but smoothed.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('Rate must be positive, '
+                             'but it is: {0}'.format(rate))
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Take @tokens from bucket, wait if bucket has not enough."""
+        with self._lock:
+            available = self._take(tokens, self._tokens, self._updated)
+        time.sleep(self._delay(available))
+
+    def try_acquire(self, tokens=1):
+        """Take @tokens if available without waiting.
+
+        :returns: bool, were tokens taken.
+        """
+        with self._lock:
+            now = time.time()
+            available = self._refill(self._tokens, self._updated, now)
+            if available < tokens:
+                return False
+            self._tokens, self._updated = available - tokens, now
+            return True
+
+    def _take(self, tokens, available, updated):
+        now = time.time()
+        available = self._refill(available, updated, now) - tokens
+        self._tokens, self._updated = available, now
+        return available
+
+    def _refill(self, available, updated, now):
+        return min(self.capacity,
+                   available + (now - updated) * self.rate)
+
+    def _delay(self, available):
+        return -available / self.rate if available < 0 else 0
+
+
+class FileTokenBucket(TokenBucket):
+    """Token bucket shared between processes through file at @path.
+
+    Bucket state is stored in file and guarded by `flock`.
+    """
+
+    def __init__(self, path, rate, capacity=None):
+        super(FileTokenBucket, self).__init__(rate, capacity)
+        self.path = path
+
+    def acquire(self, tokens=1):
+        with self._lock:
+            with self._locked_file() as state_file:
+                available = self._take(tokens, *self._read(state_file))
+                self._write(state_file)
+        time.sleep(self._delay(available))
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            with self._locked_file() as state_file:
+                available, updated = self._read(state_file)
+                now = time.time()
+                available = self._refill(available, updated, now)
+                if available < tokens:
+                    return False
+                self._tokens, self._updated = available - tokens, now
+                self._write(state_file)
+                return True
+
+    def _locked_file(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        state_file = os.fdopen(fd, 'r+')
+        fcntl.flock(state_file, fcntl.LOCK_EX)
+        return state_file
+
+    def _read(self, state_file):
+        state_file.seek(0)
+        try:
+            available, updated = state_file.read().split()
+            return float(available), float(updated)
+        except ValueError:
+            return self.capacity, time.time()
+
+    def _write(self, state_file):
+        state_file.seek(0)
+        state_file.truncate()
+        state_file.write('{0!r} {1!r}'.format(self._tokens, self._updated))
+        state_file.flush()
+
+
+class RateLimiter(object):
+    """Limit of sent messages and requests per second.
+
+    :param messages_per_second: max messages rate, None for no limit.
+    :param requests_per_second: max requests rate, None for no limit.
+    :param burst: bucket capacity in seconds of traffic.
+    :param path: if set, limits are shared between processes through
+                 files `<path>.messages` and `<path>.requests`.
+    """
+
+    def __init__(self, messages_per_second=None, requests_per_second=None,
+                 burst=1.0, path=None):
+        self.messages = self._bucket(messages_per_second, burst,
+                                     path and path + '.messages')
+        self.requests = self._bucket(requests_per_second, burst,
+                                     path and path + '.requests')
+
+    @staticmethod
+    def _bucket(rate, burst, path):
+        if rate is None:
+            return None
+        if path is None:
+            return TokenBucket(rate, rate * burst)
+        return FileTokenBucket(path, rate, rate * burst)
+
+    def acquire(self, messages=1, requests=1):
+        """Wait until @requests requests with @messages messages in
+        total are allowed.
+        """
+        if self.requests is not None and requests:
+            self.requests.acquire(requests)
+        if self.messages is not None and messages:
+            self.messages.acquire(messages)
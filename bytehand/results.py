@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Compact columnar storage of sending results.
+
+Every result takes a few dozens of bytes in typed arrays instead of
+`_SMSResponse` object with its details dict:
+    >>> store = ResultStore()
+    >>> store.extend(conn.send_bulk(msgs))          # doctest:+SKIP
+    >>> store.update(0, conn.details(store.msgid(0)))   # doctest:+SKIP
+    >>> store.count('DELIVERED'), store.total_cost()    # doctest:+SKIP
+    (1, 0.35)
+"""
+
+import math
+from array import array
+
+from definitions import DELIVERY_STATES, STATE_CODES
+
+
+# Message ids don't fit in 32 bits. Fall back to doubles, exact for
+# integers up to 2 ** 53, on platforms without 64 bit unsigned long.
+_MSGID_TYPECODE = 'L' if array('L').itemsize >= 8 else 'd'
+
+_UNKNOWN_STATE = -1
+
+
+class ResultStore(object):
+    """Results of sent messages stored by columns.
+
+    Columns: sending status, message id, delivery state, number of
+    parts and cost. State, parts and cost are filled by `update`.
+    """
+
+    def __init__(self):
+        self._status = array('i')
+        self._msgid = array(_MSGID_TYPECODE)
+        self._state = array('b')
+        self._parts = array('H')
+        self._cost = array('d')
+
+    def __len__(self):
+        return len(self._status)
+
+    def __getitem__(self, index):
+        """:returns: (status, msgid, state, parts, cost) tuple."""
+        return (self._status[index], self.msgid(index), self.state(index),
+                self._parts[index], self._cost[index])
+
+    def append(self, response):
+        """Store `_SMSResponse` of sent message.
+
+        :returns: index of stored result.
+        """
+        status = int(response.status)
+        self._status.append(status)
+        self._msgid.append(int(response.description) if status == 0 else 0)
+        self._state.append(_UNKNOWN_STATE)
+        self._parts.append(0)
+        self._cost.append(0.0)
+        return len(self._status) - 1
+
+    def extend(self, responses):
+        """Store several responses. None responses are stored as failed
+        with status -1.
+        """
+        for response in responses:
+            if response is None:
+                self._append_failed()
+            else:
+                self.append(response)
+
+    def update(self, index, details):
+        """Update result @index from `Connection.details` response."""
+        self._state[index] = STATE_CODES.get(details['description'],
+                                             _UNKNOWN_STATE)
+        if details.get('parts') is not None:
+            self._parts[index] = int(details['parts'])
+        if details.get('cost') is not None:
+            self._cost[index] = float(details['cost'])
+
+    def find(self, msgid):
+        """:returns: index of result with given @msgid.
+
+        :raises LookupError: if no such message.
+        """
+        try:
+            return self._msgid.index(int(msgid))
+        except ValueError:
+            raise LookupError('No result for message {0}'.format(msgid))
+
+    def msgid(self, index):
+        """:returns: message id string or None for failed message."""
+        if self._status[index] != 0:
+            return None
+        return str(int(self._msgid[index]))
+
+    def state(self, index):
+        """:returns: delivery state or None if unknown."""
+        code = self._state[index]
+        return None if code == _UNKNOWN_STATE else DELIVERY_STATES[code]
+
+    def count(self, state=None):
+        """:returns: number of results in delivery @state. Number of
+        results with unknown state if @state is None.
+        """
+        code = _UNKNOWN_STATE if state is None else STATE_CODES[state]
+        return self._state.count(code)
+
+    def count_ok(self):
+        """:returns: number of messages accepted by bytehand."""
+        return self._status.count(0)
+
+    def total_cost(self):
+        """:returns: float, total cost of messages with known details."""
+        return math.fsum(self._cost)
+
+    def total_parts(self):
+        """:returns: total number of parts of messages with known details.
+        """
+        return sum(self._parts)
+
+    def _append_failed(self):
+        self._status.append(-1)
+        self._msgid.append(0)
+        self._state.append(_UNKNOWN_STATE)
+        self._parts.append(0)
+        self._cost.append(0.0)
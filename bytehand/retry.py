@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Retrying of transient bytehand failures.
+
+    >>> from bytehand import Connection
+    >>> conn = Connection(userid=1342, key='5C3D5D3C2B1C4D8B',
+    ...                   retry=RetryPolicy(max_attempts=5, deadline=30))
+
+Reading requests are repeated as is. For `send_multi` only messages
+which didn't get message id are sent again, so recipients are never
+charged twice for one message. Sending requests are retried by default
+only after errors meaning nothing was sent: failed connection, 429 and
+503 statuses.
+"""
+
+import time
+import random
+import threading
+
+import requests.exceptions
+from requests.packages.urllib3.exceptions import ConnectTimeoutError
+
+from connection import HTTPError
+from dedup import message_digest
+
+
+class RetryPolicy(object):
+    """When and how to retry failed requests.
+
+    :param max_attempts: max number of attempts including first one.
+    :param statuses: http statuses considered transient.
+    :param exceptions: exception types considered transient. Read
+                       timeouts are not retried by default: message
+                       could be already sent.
+    :param backoff: delay before second attempt in seconds, doubled
+                    for each next attempt.
+    :param max_backoff: max delay between attempts.
+    :param jitter: randomize delays (full jitter).
+    :param deadline: max seconds spent on one request including all
+                     attempts and delays. None means no limit.
+    :param message_statuses: nonzero `send_multi` message statuses
+                             after which message is sent again.
+    :param send_statuses: http statuses after which sending request is
+                          repeated. Gateway or proxy could send messages
+                          before failing with other 5xx statuses.
+    :param send_exceptions: exception types after which sending request
+                            is repeated. By default only errors raised
+                            before request was sent, see
+                            `is_connect_error`.
+    """
+
+    def __init__(self, max_attempts=3, statuses=(429, 500, 502, 503, 504),
+                 exceptions=(requests.exceptions.ConnectionError,),
+                 backoff=0.5, max_backoff=30.0, jitter=True, deadline=None,
+                 message_statuses=(), send_statuses=(429, 503),
+                 send_exceptions=None):
+        if max_attempts < 1:
+            raise ValueError('At least one attempt should be allowed, '
+                             'but max_attempts is: {0}'.format(max_attempts))
+        self.max_attempts = max_attempts
+        self.statuses = frozenset(statuses)
+        self.exceptions = tuple(exceptions)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.message_statuses = frozenset(str(s) for s in message_statuses)
+        self.send_statuses = frozenset(send_statuses)
+        self.send_exceptions = tuple(send_exceptions) \
+            if send_exceptions is not None else None
+        self._random = random.Random()
+        self._random_lock = threading.Lock()
+
+    def is_retryable(self, error):
+        """Check is @error transient."""
+        if isinstance(error, HTTPError):
+            return error.status_code in self.statuses
+        return isinstance(error, self.exceptions)
+
+    def is_send_retryable(self, error):
+        """Check is sending request safe to repeat after @error."""
+        if isinstance(error, HTTPError):
+            return error.status_code in self.send_statuses
+        if self.send_exceptions is None:
+            return is_connect_error(error)
+        return isinstance(error, self.send_exceptions)
+
+    def delay(self, attempt):
+        """:returns: seconds to wait after failed @attempt (1-based)."""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        if self.jitter:
+            with self._random_lock:
+                delay = self._random.uniform(0, delay)
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """Call @func until it succeeds or policy is exhausted."""
+        return self._call(self.is_retryable, func, args, kwargs)
+
+    def call_send(self, func, *args, **kwargs):
+        """Call sending @func, repeat it only after send retryable
+        errors.
+        """
+        return self._call(self.is_send_retryable, func, args, kwargs)
+
+    def _call(self, is_retryable, func, args, kwargs):
+        started = time.time()
+        attempt = 1
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as error:
+                if not is_retryable(error) or \
+                        not self._wait(attempt, started):
+                    raise
+            attempt += 1
+
+    def send_multi(self, send, msgs):
+        """Send @msgs with @send, resubmit only messages without id.
+
+        Messages are tracked by client-side dedup key: hash of message
+        and its occurrence number, so identical messages in @msgs are
+        still sent separately.
+
+        :param send: callable sending list of messages and returning
+                     list of responses.
+
+        :returns: list of responses in order of @msgs. For messages which
+        failed all attempts last error response is returned.
+        """
+        keys = _dedup_keys(msgs)
+        by_key = dict(zip(keys, msgs))
+        results = {}
+        pending = list(keys)
+        started = time.time()
+        attempt = 1
+        while True:
+            try:
+                responses = send([by_key[key] for key in pending])
+            except Exception as error:
+                if not self.is_send_retryable(error) or \
+                        not self._wait(attempt, started):
+                    raise
+            else:
+                retry = []
+                for key, response in zip(pending, responses):
+                    results[key] = response
+                    if str(response.status) in self.message_statuses:
+                        retry.append(key)
+                pending = retry
+                if not pending or not self._wait(attempt, started):
+                    return [results[key] for key in keys]
+            attempt += 1
+
+    def _wait(self, attempt, started):
+        """Sleep before next attempt.
+
+        :returns: False if no attempts left.
+        """
+        if attempt >= self.max_attempts:
+            return False
+        delay = self.delay(attempt)
+        if self.deadline is not None and \
+                time.time() + delay - started > self.deadline:
+            return False
+        time.sleep(delay)
+        return True
+
+
+def is_connect_error(error):
+    """Check @error happened before request was sent: connection
+    was refused or timed out.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or \
+            not error.args:
+        return False
+    reason = getattr(error.args[0], 'reason', None)
+    return isinstance(reason, ConnectTimeoutError)
+
+
+def _dedup_keys(msgs):
+    seen = {}
+    keys = []
+    for msg in msgs:
+        digest = message_digest(msg)
+        seen[digest] = seen.get(digest, 0) + 1
+        keys.append((digest, seen[digest]))
+    return keys
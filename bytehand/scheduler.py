@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Prioritized queue of outgoing messages.
+
+    >>> scheduler = SendScheduler(conn)                 # doctest:+SKIP
+    >>> future = scheduler.submit(
+    ...     {'to': '79001234567', 'from': 'bank', 'text': 'Code: 1234'},
+    ...     priority=PRIORITY_HIGH)                     # doctest:+SKIP
+    >>> future.result().description                     # doctest:+SKIP
+    '4242424242'
+
+Queued messages are sent by batches through `send_multi`, messages with
+higher priority (lower number) go first. Combine with `RateLimiter`
+of connection to smooth bursts.
+"""
+
+import heapq
+import itertools
+import threading
+
+from future import Future
+
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+
+class SendScheduler(object):
+    """Queue messages and send them by batches in background threads.
+
+    :param conn: `Connection` to send messages with.
+    :param batch_size: max number of messages in one request.
+    :param workers: number of sending threads.
+    """
+
+    def __init__(self, conn, batch_size=100, workers=1):
+        self._connection = conn
+        self.batch_size = batch_size
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._threads = [threading.Thread(target=self._work)
+                         for _ in xrange(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """Number of queued messages."""
+        return len(self._queue)
+
+    def submit(self, msg, priority=PRIORITY_NORMAL):
+        """Queue @msg for sending.
+
+        :param msg: dict in `send_multi` format.
+        :param priority: lower value is sent first.
+
+        :returns: `Future` of `_SMSResponse`.
+        """
+        future = Future()
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError('Scheduler is closed')
+            heapq.heappush(self._queue,
+                           (priority, next(self._counter), msg, future))
+            self._condition.notify()
+        return future
+
+    def close(self, wait=True):
+        """Stop sending threads.
+
+        :param wait: send already queued messages before stop.
+        """
+        with self._condition:
+            self._stopped = True
+            if not wait:
+                dropped, self._queue = self._queue, []
+            else:
+                dropped = []
+            self._condition.notify_all()
+        for _, _, _, future in dropped:
+            future.set_exception(RuntimeError('Scheduler is closed'))
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                batch = [heapq.heappop(self._queue) for _ in
+                         xrange(min(self.batch_size, len(self._queue)))]
+            self._send(batch)
+
+    def _send(self, batch):
+        try:
+            responses = self._connection.send_multi(
+                [msg for _, _, msg, _ in batch])
+        except Exception as error:
+            for _, _, _, future in batch:
+                future.set_exception(error)
+            return
+        for (_, _, _, future), response in zip(batch, responses):
+            future.set_result(response)
@@ -1,13 +1,29 @@
 # -*- coding: utf-8 -*-
 
-import requests
-import urlparse
-import urllib
-
-from definitions import API_URL
 from connection import Connection
 
 
+def check_message(to, signature, text):
+    """Check message fields the same way as `send_sms` does.
+
+    :raises TypeError: if message can't be sent.
+
+    :returns: @to as string.
+    """
+    if isinstance(to, unicode):
+        to = to.encode('utf-8')
+    to = str(to)
+    if not to.isdigit():
+        raise TypeError('Incorrect "to"-field format. '
+                        'It must be string of digits, '
+                        'but it is: "{}"'.format(to))
+    if not text:
+        raise TypeError('Can\'t send empty message.')
+    if not signature:
+        raise TypeError('Signature should be set.')
+    return to
+
+
 def send_sms(to, signature, text, userid, key):
     """Fast function for sending sms.
 
@@ -24,16 +40,8 @@ def send_sms(to, signature, text, userid, key):
 
     :see: https://www.bytehand.com/secure/settings to get your key and id.
     """
-    to = str(to)
+    to = check_message(to, signature, text)
     userid = str(userid)
-    if not to.isdigit():
-        raise TypeError('Incorrect "to"-field format. '
-                        'It must be string of digits, '
-                        'but it is: "{}"'.format(to))
-    if not text:
-        raise TypeError('Can\'t send empty message.')
-    if not signature:
-        raise TypeError('Signature should be set.')
     if not userid.isdigit():
         raise TypeError('User id must be digit, '
                         'but it is: {}'.format(userid))
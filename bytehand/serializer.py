@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Json serialization used by bytehand connections.
+
+The fastest available library is used: orjson, ujson or simplejson,
+with fallback to standard json module:
+    >>> serializer = get_serializer()
+    >>> serializer.loads('{"status": 0}')
+    {u'status': 0}
+
+Large json arrays may be decoded incrementally from chunks of response
+body by `iter_array`.
+"""
+
+import json
+import codecs
+
+
+class Serializer(object):
+    """Pair of json encoding and decoding functions.
+
+    :param name: name of json library.
+    :param dumps: callable encoding object to json string.
+    :param loads: callable decoding json string.
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self._constants = {}
+
+    def __repr__(self):
+        return 'Serializer({0!r})'.format(self.name)
+
+    def encode_messages(self, msgs):
+        """Encode list of messages in `send_multi` format.
+
+        Standard json is slower for dicts than for strings, so messages
+        with usual fields are encoded field by field. Encoded signatures
+        are cached and reused between batches.
+        """
+        if self.name != 'json':
+            return self.dumps(msgs)
+        items = []
+        constants = self._constants
+        for msg in msgs:
+            if len(msg) != 3 or 'to' not in msg or 'from' not in msg or \
+                    'text' not in msg:
+                items.append(json.dumps(msg))
+                continue
+            signature = msg['from']
+            encoded = constants.get(signature)
+            if encoded is None:
+                if len(constants) >= 1024:
+                    constants.clear()
+                encoded = constants[signature] = _encode_value(signature)
+            items.append('{"to": %s, "from": %s, "text": %s}' % (
+                _encode_value(msg['to']), encoded,
+                _encode_value(msg['text'])))
+        return '[' + ', '.join(items) + ']'
+
+
+_encode_string = json.encoder.encode_basestring_ascii
+
+
+def _encode_value(value):
+    if isinstance(value, basestring):
+        return _encode_string(value)
+    return json.dumps(value)
+
+
+def _orjson():
+    import orjson
+    return Serializer('orjson', orjson.dumps, orjson.loads)
+
+
+def _ujson():
+    import ujson
+    return Serializer('ujson', ujson.dumps, ujson.loads)
+
+
+def _simplejson():
+    import simplejson
+    return Serializer('simplejson', simplejson.dumps, simplejson.loads)
+
+
+def _json():
+    return Serializer('json', json.dumps, json.loads)
+
+
+_FACTORIES = [('orjson', _orjson), ('ujson', _ujson),
+              ('simplejson', _simplejson), ('json', _json)]
+
+
+def get_serializer(name=None):
+    """:returns: `Serializer` of json library with given @name or of
+    the fastest installed one.
+
+    :raises ImportError: if library @name is not installed.
+    """
+    for factory_name, factory in _FACTORIES:
+        if name is not None and name != factory_name:
+            continue
+        try:
+            return factory()
+        except ImportError:
+            if name is not None:
+                raise
+    raise ValueError('Unknown json library: {0}'.format(name))
+
+
+def iter_array(chunks, encoding='utf-8'):
+    """Decode json array from iterable of byte @chunks lazily.
+
+    Yields array items as soon as they are received.
+
+    :raises ValueError: if data is not valid json array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    chunks = iter(chunks)
+    buf = u''
+    pos = 0
+    finished = False
+
+    def more():
+        for chunk in chunks:
+            if chunk:
+                return text_decoder.decode(chunk)
+        return None
+
+    def skip(buf, pos, chars):
+        while pos < len(buf) and buf[pos] in chars:
+            pos += 1
+        return pos
+
+    # Next expected token: '[', first item or ']', item, ',' or ']'.
+    expect = 'start'
+    while True:
+        pos = skip(buf, pos, u' \t\r\n')
+        if pos >= len(buf):
+            data = None if finished else more()
+            if data is None:
+                raise ValueError('Unexpected end of json array')
+            buf, pos = buf[pos:] + data, 0
+            continue
+        char = buf[pos]
+        if expect == 'start':
+            if char != u'[':
+                raise ValueError('Json array expected')
+            expect = 'first'
+            pos += 1
+            continue
+        if char == u']' and expect in ('first', 'separator'):
+            return
+        if expect == 'separator':
+            if char != u',':
+                raise ValueError('Comma expected between json array items')
+            expect = 'item'
+            pos += 1
+            continue
+        if char in u',]':
+            raise ValueError('Json array item expected')
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            item, end = None, None
+        if end is None or (end == len(buf) and not finished):
+            # Item may be incomplete, e.g. number split between chunks.
+            data = more()
+            if data is None:
+                finished = True
+                if end is None:
+                    raise ValueError('Bad json array item')
+            else:
+                buf, pos = buf[pos:] + data, 0
+                continue
+        yield item
+        pos = end
+        expect = 'separator'
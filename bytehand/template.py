@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Templates of personalized messages.
+
+    >>> tmpl = Template(u'Hello, {name}! Your code: {code}')
+    >>> tmpl.render({'name': 'Kate', 'code': 42})
+    u'Hello, Kate! Your code: 42'
+
+Template is parsed once: constant parts are stored already escaped for
+json, so `send_multi` request body is built by joining escaped pieces
+without intermediate message dicts.
+"""
+
+import json
+import string
+
+
+def _escape(text):
+    """:returns: @text escaped as json string content, without quotes."""
+    return json.dumps(text)[1:-1]
+
+
+def _to_unicode(text):
+    return text if isinstance(text, unicode) else text.decode('utf-8')
+
+
+class Template(object):
+    """Compiled message template.
+
+    :param text: template in `str.format` syntax: 'Hello, {name}!'.
+                 Only named fields with optional format spec are
+                 supported: no conversions ('{name!r}'), attribute or
+                 item access ('{user.name}') and nested fields in spec.
+    """
+
+    def __init__(self, text):
+        self.text = _to_unicode(text)
+        self._literals = []
+        self._fields = []
+        for literal, field, spec, conversion in \
+                string.Formatter().parse(self.text):
+            if field is not None and not field:
+                raise ValueError('Positional template fields are not '
+                                 'supported: {0!r}'.format(self.text))
+            if conversion or field and ('.' in field or '[' in field) or \
+                    spec and '{' in spec:
+                raise ValueError('Only plain named template fields are '
+                                 'supported: {0!r}'.format(self.text))
+            self._literals.append(literal)
+            self._fields.append(None if field is None else (field, spec))
+        self._escaped = [_escape(literal) for literal in self._literals]
+
+    @property
+    def fields(self):
+        """Names of template fields."""
+        return [field[0] for field in self._fields if field is not None]
+
+    def render(self, variables):
+        """:returns: unicode text with @variables substituted."""
+        return u''.join(self._pieces(self._literals, variables, _to_text))
+
+    def render_json(self, variables):
+        """:returns: rendered text escaped as json string content."""
+        return ''.join(self._pieces(self._escaped, variables,
+                                    lambda value, spec:
+                                    _escape(_to_text(value, spec))))
+
+    def _pieces(self, literals, variables, convert):
+        for literal, field in zip(literals, self._fields):
+            yield literal
+            if field is not None:
+                name, spec = field
+                yield convert(variables[name], spec)
+
+
+def _to_text(value, spec):
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    return format(value, spec) if spec else unicode(value)
+
+
+class BatchEncoder(object):
+    """Encode recipients of template in `send_multi` json body.
+
+    Identical variables of one batch are rendered once.
+
+    :param tmpl: `Template`.
+    :param signature: "from" field of messages.
+    """
+
+    def __init__(self, tmpl, signature):
+        self.template = tmpl
+        self._from = json.dumps(_to_unicode(signature))
+        self._field_names = tmpl.fields
+
+    def encode(self, recipients):
+        """:returns: json body for list of (to, variables) @recipients."""
+        rendered = {}
+        items = []
+        for to, variables in recipients:
+            key = tuple(variables[name] for name in self._field_names)
+            try:
+                text = rendered.get(key)
+            except TypeError:
+                # Unhashable variables are rendered every time.
+                key = text = None
+            if text is None:
+                text = self.template.render_json(variables)
+                if key is not None:
+                    rendered[key] = text
+            items.append('{"to": "%s", "from": %s, "text": "%s"}' % (
+                _escape(str(to)), self._from, text))
+        return '[' + ', '.join(items) + ']'
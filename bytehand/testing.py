@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Local fake bytehand gateway for tests and benchmarks.
+
+    >>> with FakeGateway(latency=0.01,
+    ...                  error_rate=0.05) as gateway:  # doctest:+SKIP
+    ...     conn = Connection(userid=1, key='key', api_url=gateway.url)
+    ...     response = conn.send(to=79001234567, signature='bytehand',
+    ...                          text='Hi!')
+
+Gateway implements `send_multi`, `details`, `balance`, `signatures`
+and `signature` api methods over plain http. Sent messages become
+DELIVERED after `delivery_delay` seconds.
+"""
+
+import json
+import time
+import random
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+from decimal import Decimal
+
+from parts import count_parts
+from ratelimit import TokenBucket
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeGateway(object):
+    """Bytehand api emulation running in background thread.
+
+    :param latency: seconds added to every response.
+    :param error_rate: probability of http 503 response.
+    :param rate_limit: max requests per second, exceeding requests get
+                       http 429. None means no limit.
+    :param delivery_delay: seconds before message state changes from
+                           NEW to DELIVERED.
+    :param balance: initial account balance in rubles.
+    :param price: cost of one sms part in rubles.
+    :param seed: random seed for error injection.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit=None,
+                 delivery_delay=0.0, balance='100500.00', price='0.35',
+                 seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.delivery_delay = delivery_delay
+        self.price = Decimal(price)
+        self.balance = Decimal(balance)
+        self.messages = {}
+        self.signatures = {}
+        self.requests = {}
+        self._bucket = None if rate_limit is None \
+            else TokenBucket(rate_limit, rate_limit)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = iter(xrange(10 ** 9, 10 ** 10))
+        self._server = _Server(('127.0.0.1', 0), _handler(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base api url of gateway."""
+        return 'http://{0}:{1}'.format(*self._server.server_address)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def add_signature(self, text, state='ACCEPTED', description=''):
+        """Register signature in given @state."""
+        with self._lock:
+            sign_id = next(self._ids)
+            self.signatures[sign_id] = {
+                'id': sign_id, 'text': text, 'description': description,
+                'created_at': time.strftime('%Y-%m-%d'), 'state': state}
+        return sign_id
+
+    def handle(self, method, path, query, body):
+        """:returns: (http status, response object) for request."""
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            failed = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if self._bucket is not None and not self._bucket.try_acquire():
+            return 429, None
+        if failed:
+            return 503, None
+        handler = getattr(self, '_{0}_{1}'.format(method, path.strip('/')),
+                          None)
+        if handler is None:
+            return 404, None
+        return 200, handler(query, body)
+
+    def _post_send_multi(self, query, body):
+        result = []
+        now = time.time()
+        with self._lock:
+            for msg in json.loads(body):
+                if not msg.get('text') or not str(msg.get('to')).isdigit():
+                    result.append({'status': 1,
+                                   'description': 'Bad message'})
+                    continue
+                msgid = str(next(self._ids))
+                parts = count_parts(msg['text'])
+                cost = self.price * parts
+                self.balance -= cost
+                self.messages[msgid] = (now, parts, cost)
+                result.append({'status': 0, 'description': msgid})
+        return result
+
+    def _get_details(self, query, body):
+        with self._lock:
+            message = self.messages.get(query.get('message'))
+        if message is None:
+            return {'status': 1, 'description': 'Unknown message'}
+        posted, parts, cost = message
+        delivered = time.time() - posted >= self.delivery_delay
+        posted_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(posted))
+        return {'status': 0,
+                'description': 'DELIVERED' if delivered else 'NEW',
+                'posted_at': posted_at, 'updated_at': posted_at,
+                'parts': parts, 'cost': str(cost)}
+
+    def _get_balance(self, query, body):
+        with self._lock:
+            return {'status': 0, 'description': str(self.balance)}
+
+    def _get_signatures(self, query, body):
+        state = query.get('state')
+        with self._lock:
+            return [sign for sign in self.signatures.itervalues()
+                    if state is None or sign['state'] == state]
+
+    def _post_signature(self, query, body):
+        description = urlparse.parse_qs(body).get('description', [''])[0]
+        sign_id = self.add_signature(query['text'], 'NEW', description)
+        return {'status': 0, 'description': str(sign_id)}
+
+    def _delete_signature(self, query, body):
+        with self._lock:
+            self.signatures.pop(int(query['signature']), None)
+        return {'status': 0, 'description': 'OK'}
+
+
+def _handler(gateway):
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Write response at once, otherwise delayed ACK of headers adds
+        # tens of milliseconds to every keep-alive request.
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def _respond(self):
+            parsed = urlparse.urlparse(self.path)
+            query = dict(urlparse.parse_qsl(parsed.query))
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else ''
+            status, result = gateway.handle(self.command.lower(),
+                                            parsed.path, query, body)
+            content = '' if result is None else json.dumps(result)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_DELETE = _respond
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Delivery tracking for many messages at once.
+
+    >>> responses = conn.send_bulk(msgs)            # doctest:+SKIP
+    >>> tracker = DeliveryTracker(conn, [r.description for r in responses
+    ...                                  if r.ok])  # doctest:+SKIP
+    >>> for msgid, old, new in tracker.iter_transitions():
+    ...     print msgid, old, '->', new             # doctest:+SKIP
+
+Ids are polled concurrently. Polling interval grows while no states
+change and is reset on any change. Ids in terminal states
+(see `definitions.TERMINAL_STATES`) are not polled anymore, neither
+are ids failed `max_errors` polls in a row.
+"""
+
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+
+from definitions import TERMINAL_STATES, intern_state
+
+
+class DeliveryTracker(object):
+    """Poll delivery states of many messages.
+
+    :param conn: `Connection` messages were sent by.
+    :param msgids: message ids to track.
+    :param workers: max number of concurrent `details` requests.
+    :param min_interval: seconds between polls after state changes.
+    :param max_interval: max seconds between polls.
+    :param backoff: interval multiplier for polls without changes.
+    :param on_transition: callable called with (msgid, old, new) on
+                          every state change. Old state is None for
+                          first known state.
+    :param max_errors: number of failed polls of message in a row (error
+                       or nonzero status, e.g. unknown message) after
+                       which it is not polled anymore. Last error is
+                       kept in `errors`.
+    """
+
+    def __init__(self, conn, msgids=(), workers=4, min_interval=1.0,
+                 max_interval=60.0, backoff=2.0, on_transition=None,
+                 max_errors=5):
+        self._connection = conn
+        self.workers = workers
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.on_transition = on_transition
+        self.max_errors = max_errors
+        self._states = {}
+        self._pending = set()
+        self._failed = set()
+        self._error_counts = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self.add(msgids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop polling threads."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def add(self, msgids):
+        """Start tracking of given @msgids."""
+        with self._lock:
+            for msgid in msgids:
+                if msgid not in self._states:
+                    self._states[msgid] = None
+                    self._pending.add(msgid)
+
+    def state(self, msgid):
+        """:returns: last known state of @msgid or None."""
+        return self._states[msgid]
+
+    @property
+    def done(self):
+        """True if all tracked messages are in terminal states or
+        failed.
+        """
+        return not self._pending
+
+    def progress(self):
+        """:returns: dict with number of messages in each known state,
+        plus 'pending', 'done' and 'failed' counts. Unknown state is
+        counted as None.
+        """
+        with self._lock:
+            counts = {'pending': len(self._pending),
+                      'failed': len(self._failed),
+                      'done': len(self._states) - len(self._pending) -
+                      len(self._failed)}
+            for state in self._states.itervalues():
+                counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def poll(self):
+        """Poll all pending messages once.
+
+        :returns: list of (msgid, old, new) state transitions.
+        """
+        with self._lock:
+            pending = list(self._pending)
+        if not pending:
+            return []
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+        results = self._pool.map(self._fetch_state, pending)
+
+        transitions = []
+        with self._lock:
+            for msgid, (state, error) in zip(pending, results):
+                if error is not None:
+                    self.errors[msgid] = error
+                    count = self._error_counts.get(msgid, 0) + 1
+                    self._error_counts[msgid] = count
+                    if count >= self.max_errors:
+                        self._pending.discard(msgid)
+                        self._failed.add(msgid)
+                    continue
+                self.errors.pop(msgid, None)
+                self._error_counts.pop(msgid, None)
+                old = self._states[msgid]
+                if state == old:
+                    continue
+                self._states[msgid] = state
+                if state in TERMINAL_STATES:
+                    self._pending.discard(msgid)
+                transitions.append((msgid, old, state))
+        if self.on_transition is not None:
+            for transition in transitions:
+                self.on_transition(*transition)
+        return transitions
+
+    def iter_transitions(self, timeout=None):
+        """Poll until all messages are in terminal states and yield
+        (msgid, old, new) state transitions.
+
+        :param timeout: stop polling after @timeout seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        interval = self.min_interval
+        while not self.done:
+            transitions = self.poll()
+            for transition in transitions:
+                yield transition
+            if self.done:
+                return
+            if transitions:
+                interval = self.min_interval
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+            if deadline is not None:
+                left = deadline - time.time()
+                if left <= 0:
+                    return
+                interval = min(interval, left)
+            time.sleep(interval)
+
+    def run(self, timeout=None):
+        """Poll until all messages are in terminal states.
+
+        :param timeout: stop polling after @timeout seconds.
+
+        :returns: `progress()` after polling.
+        """
+        for _ in self.iter_transitions(timeout=timeout):
+            pass
+        return self.progress()
+
+    def _fetch_state(self, msgid):
+        try:
+            details = self._connection.details(msgid)
+            if int(details['status']) != 0:
+                return None, details['description']
+            return intern_state(details['description']), None
+        except Exception as error:
+            return None, error
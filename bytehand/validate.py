@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Pre-flight validation of message batches.
+
+    >>> validator = BatchValidator.from_connection(conn)    # doctest:+SKIP
+    >>> clean, rejects = validator.validate(msgs)           # doctest:+SKIP
+    >>> conn.send_bulk(clean)                               # doctest:+SKIP
+
+Phone numbers are normalized: spaces, dashes, dots, parentheses and
+leading '+' are removed. Messages with bad numbers, empty texts or
+signatures not in allowlist are rejected, as well as repeated
+recipients within the batch and all previous batches.
+"""
+
+import collections
+
+
+BAD_NUMBER = 'bad_number'
+EMPTY_TEXT = 'empty_text'
+NO_SIGNATURE = 'no_signature'
+UNVERIFIED_SIGNATURE = 'unverified_signature'
+DUPLICATE = 'duplicate'
+
+_FORMATTING = ' -().+'
+_UNICODE_FORMATTING = dict((ord(char), None) for char in _FORMATTING)
+
+
+Reject = collections.namedtuple('Reject', 'index msg reason')
+
+
+def normalize_phone(to):
+    """:returns: @to with formatting characters removed.
+
+    Result is not checked to be digits.
+    """
+    if isinstance(to, unicode):
+        return to.translate(_UNICODE_FORMATTING).encode('ascii', 'replace')
+    to = str(to)
+    if to.isdigit():
+        return to
+    return to.translate(None, _FORMATTING)
+
+
+class BatchValidator(object):
+    """Validate and normalize batches of messages.
+
+    :param signatures: allowed signature texts, None to allow any.
+    :param dedupe: reject messages to already seen recipients.
+    :param min_digits: min length of normalized phone number.
+    :param max_digits: max length of normalized phone number.
+    """
+
+    def __init__(self, signatures=None, dedupe=True, min_digits=10,
+                 max_digits=15):
+        self.signatures = None if signatures is None \
+            else frozenset(signatures)
+        self.dedupe = dedupe
+        self.min_digits = min_digits
+        self.max_digits = max_digits
+        self._seen = set()
+
+    @classmethod
+    def from_connection(cls, conn, **kwargs):
+        """Create validator allowing only signatures accepted on bytehand.
+        """
+        accepted = [sign['text'] for sign in conn.signatures('ACCEPTED')]
+        return cls(signatures=accepted, **kwargs)
+
+    def reset(self):
+        """Forget recipients of previous batches."""
+        self._seen = set()
+
+    def validate(self, msgs):
+        """Validate @msgs iterable of dicts in `send_multi` format.
+
+        :returns: (clean, rejects) pair. clean is list of normalized
+        messages, rejects is list of `Reject(index, msg, reason)`.
+        """
+        clean = []
+        rejects = []
+        seen = self._seen
+        signatures = self.signatures
+        min_digits, max_digits = self.min_digits, self.max_digits
+        for index, msg in enumerate(msgs):
+            to = normalize_phone(msg.get('to', ''))
+            signature = msg.get('from')
+            if not to.isdigit() or \
+                    not min_digits <= len(to) <= max_digits:
+                reason = BAD_NUMBER
+            elif not msg.get('text'):
+                reason = EMPTY_TEXT
+            elif not signature:
+                reason = NO_SIGNATURE
+            elif signatures is not None and signature not in signatures:
+                reason = UNVERIFIED_SIGNATURE
+            elif self.dedupe and to in seen:
+                reason = DUPLICATE
+            else:
+                if self.dedupe:
+                    seen.add(to)
+                clean.append({'to': to, 'from': signature,
+                              'text': msg['text']})
+                continue
+            rejects.append(Reject(index, msg, reason))
+        return clean, rejects
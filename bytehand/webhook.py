@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Delivery report receiver.
+
+Receiver is WSGI application accepting delivery callbacks. Watched
+messages get `Future` resolved when message reaches terminal state:
+    >>> receiver = DeliveryReceiver(conn, silence=600)  # doctest:+SKIP
+    >>> server = serve(receiver, port=8080)         # doctest:+SKIP
+    >>> future = receiver.watch(response.description)  # doctest:+SKIP
+    >>> future.add_done_callback(on_final_state)    # doctest:+SKIP
+
+Callback request may be GET or POST with form or json body. Message id
+is read from "message", "msgid" or "id" field, state from "state",
+"description" or "status" field. Numeric values are skipped: in
+bytehand `details` format "status" is status of request, not state.
+
+Messages with no reports for `silence` seconds are checked with
+`details` request by `poll_silent`, run it periodically as fallback.
+"""
+
+import json
+import time
+import urlparse
+import threading
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+from definitions import TERMINAL_STATES, intern_state
+from future import Future
+
+
+_ID_FIELDS = ('message', 'msgid', 'id')
+_STATE_FIELDS = ('state', 'description', 'status')
+
+
+class _Watch(object):
+    __slots__ = ('future', 'state', 'updated')
+
+    def __init__(self, now):
+        self.future = Future()
+        self.state = None
+        self.updated = now
+
+
+class DeliveryReceiver(object):
+    """WSGI application resolving watched messages by delivery reports.
+
+    :param conn: `Connection` for fallback polling, may be None.
+    :param silence: seconds without reports after which message is
+                    polled by `poll_silent`.
+    :param on_report: callable called with (msgid, state) on every
+                      accepted report, watched or not.
+    """
+
+    def __init__(self, conn=None, silence=300, on_report=None):
+        self._connection = conn
+        self.silence = silence
+        self.on_report = on_report
+        self._lock = threading.Lock()
+        self._watches = {}
+
+    def __len__(self):
+        """Number of messages waiting for terminal state."""
+        return len(self._watches)
+
+    def watch(self, msgid):
+        """:returns: `Future` of final delivery state of @msgid."""
+        msgid = str(msgid)
+        with self._lock:
+            watch = self._watches.get(msgid)
+            if watch is None:
+                watch = self._watches[msgid] = _Watch(time.time())
+        return watch.future
+
+    def state(self, msgid):
+        """:returns: last reported state of watched @msgid or None."""
+        watch = self._watches.get(str(msgid))
+        return None if watch is None else watch.state
+
+    def report(self, msgid, state):
+        """Accept delivery @state of @msgid.
+
+        :returns: True if message was watched.
+        """
+        msgid = str(msgid)
+        state = intern_state(state)
+        finished = None
+        with self._lock:
+            watch = self._watches.get(msgid)
+            if watch is not None:
+                watch.state = state
+                watch.updated = time.time()
+                if state in TERMINAL_STATES:
+                    finished = self._watches.pop(msgid)
+        if self.on_report is not None:
+            self.on_report(msgid, state)
+        if finished is not None:
+            finished.future.set_result(state)
+        return watch is not None
+
+    def poll_silent(self):
+        """Request details of watched messages without reports for
+        `silence` seconds.
+
+        :returns: number of polled messages.
+        """
+        if self._connection is None:
+            raise ValueError('Connection is required for polling')
+        deadline = time.time() - self.silence
+        with self._lock:
+            silent = [msgid for msgid, watch in self._watches.iteritems()
+                      if watch.updated <= deadline]
+        for msgid in silent:
+            try:
+                details = self._connection.details(msgid)
+            except Exception:
+                continue
+            if int(details['status']) == 0:
+                self.report(msgid, details['description'])
+        return len(silent)
+
+    def __call__(self, environ, start_response):
+        fields = dict(urlparse.parse_qsl(environ.get('QUERY_STRING', '')))
+        try:
+            fields.update(self._read_body(environ))
+            msgid = _first(fields, _ID_FIELDS)
+            state = _first(fields, _STATE_FIELDS, numeric=False)
+        except (ValueError, KeyError):
+            start_response('400 Bad Request',
+                           [('Content-Type', 'text/plain')])
+            return ['Bad delivery report\n']
+        self.report(msgid, state)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return ['OK\n']
+
+    @staticmethod
+    def _read_body(environ):
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        if not length:
+            return {}
+        body = environ['wsgi.input'].read(length)
+        if environ.get('CONTENT_TYPE', '').startswith('application/json'):
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError('Json report must be object')
+            return data
+        return dict(urlparse.parse_qsl(body))
+
+
+def _first(fields, names, numeric=True):
+    for name in names:
+        value = fields.get(name)
+        if value in (None, ''):
+            continue
+        if not numeric and (isinstance(value, (int, long)) or
+                            isinstance(value, basestring) and
+                            value.isdigit()):
+            continue
+        return value
+    raise KeyError(names[0])
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(receiver, host='', port=8080):
+    """Serve @receiver in background thread.
+
+    :returns: wsgiref server, call `shutdown()` to stop it.
+    """
+    server = make_server(host, port, receiver, handler_class=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -7,7 +7,7 @@ setup(name='Bytehand',
       description='Bytehand sms gateway api',
       author='Aman Orazaev',
       author_email='aorazaev@gmail.com',
-      install_requires=['requests>=2.2.1'],
+      install_requires=['requests>=2.4'],
       url='https://github.com/aorazaev/bytehand',
       packages=['bytehand'],
       license="MIT"
@@ -4,14 +4,82 @@
 import bytehand
 
 import unittest
-import urllib
 import requests
 import urlparse
 import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import logging
+import subprocess
+import sys
+
+
+class TestBytehandImport(unittest.TestCase):
+
+    def test_http_stack_is_imported_lazily(self):
+        script = ('import sys, bytehand; '
+                  'bytehand.Connection, bytehand.send_sms; '
+                  'print "requests" in sys.modules; '
+                  'bytehand.Connection(1, "k")._get_session(); '
+                  'print "requests" in sys.modules')
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         cwd=root)
+        self.assertEqual(output.split(), ['False', 'True'])
+
+    def test_lazy_names(self):
+        self.assertIs(bytehand.HTTPError, bytehand.connection.HTTPError)
+        self.assertEqual(bytehand.PRIORITY_HIGH,
+                         bytehand.scheduler.PRIORITY_HIGH)
+        self.assertTrue(set(bytehand.__all__) <= set(dir(bytehand)))
+        self.assertRaises(AttributeError, lambda: bytehand.missing)
+
+
+class TestBytehandProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.proto = bytehand.Protocol(userid=1342, key='MY KEY',
+                                       api_url='http://localhost:8080/api')
+
+    def test_requests(self):
+        request = self.proto.send_multi([{'to': '1', 'from': 'Mom',
+                                          'text': 'Hi!'}])
+        self.assertEqual(request.method, 'post')
+        self.assertEqual(request.url, 'http://localhost:8080/api/send_multi'
+                                      '?id=1342&key=MY+KEY')
+        self.assertEqual(json.loads(request.body),
+                         [{'to': '1', 'from': 'Mom', 'text': 'Hi!'}])
+        self.assertEqual(request.batch_size, 1)
+        self.assertEqual(self.proto.details('100').url,
+                         'http://localhost:8080/api/details?id=1342'
+                         '&key=MY+KEY&message=100')
+        self.assertEqual(
+            bytehand.Protocol(1, 'k', api_url='https://proxy.example/'
+                                              'bytehand/').balance().url,
+            'https://proxy.example/bytehand/balance?id=1&key=k')
+        self.assertTrue(self.proto.signatures('new').url.endswith(
+            '&state=NEW'))
+        self.assertRaises(ValueError, self.proto.signatures, 'OLD')
+
+    def test_parse(self):
+        data = self.proto.loads('[{"status": 0, "description": "1"},'
+                                ' {"status": 3, "description": "Bad"}]')
+        self.assertEqual(list(self.proto.parse_send_multi(data)),
+                         [(0, '1'), (3, 'Bad')])
+        self.assertRaises(bytehand.ConnectionError, self.proto.check_status,
+                          data[1])
+        request = self.proto.balance()
+        self.proto.check_http(request, 200)
+        with self.assertRaises(bytehand.HTTPError) as raised:
+            self.proto.check_http(request, 503)
+        self.assertEqual(raised.exception.url, request.url)
 
 
 class TestCaseWithPatchedRequests(unittest.TestCase):
-    """Monkey-patch requests.get and requests.post functions for tests
+    """Monkey-patch requests.Session.request method for tests
     """
 
     ok_response = requests.Response()
@@ -41,16 +109,18 @@ class TestCaseWithPatchedRequests(unittest.TestCase):
     )
 
     def setUp(self):
-        self.requests_request = requests.request
+        self.requests_request = requests.Session.request
 
         self.last_url = None
         self.request_method = None
         self.post_data = None
         self.request_urls = []
+        self.sessions = []
 
-        def patched_request(method, url, **kwargs):
+        def patched_request(session, method, url, **kwargs):
             self.last_url = url
             self.request_urls.append(url)
+            self.sessions.append(session)
             self.post_data = kwargs.get('data')
             self.request_method = method
             if urlparse.urlparse(url).path.endswith('balance'):
@@ -60,10 +130,10 @@ class TestCaseWithPatchedRequests(unittest.TestCase):
             elif urlparse.urlparse(url).path.endswith('signature'):
                 return self.new_signature_response
             return self.ok_response
-        requests.request = patched_request
+        requests.Session.request = patched_request
 
     def tearDown(self):
-        requests.request = self.requests_request
+        requests.Session.request = self.requests_request
         del self.requests_request
         del self.last_url
         del self.post_data
@@ -79,9 +149,8 @@ class TestBytehandSendSms(TestCaseWithPatchedRequests):
                                         'send_multi?id=1342&key=Password')
         self.assertEqual(self.last_url, expected_url)
         self.assertEqual(
-            json.dumps([{'to': '7771234567', 'from': 'Patric',
-                         'text': 'Hello, Kate!'}]),
-            self.post_data
+            [{'to': '7771234567', 'from': 'Patric', 'text': 'Hello, Kate!'}],
+            json.loads(self.post_data)
         )
 
     def test_send_sms_raises(self):
@@ -124,8 +193,7 @@ class TestBytehandConnection(TestCaseWithPatchedRequests):
             urlparse.urljoin(bytehand.API_URL,
                              'send_multi?id=1342&key=MYKEY4321')
         )
-        expected_data = json.dumps([msg])
-        self.assertEqual(self.post_data, expected_data)
+        self.assertEqual(json.loads(self.post_data), [msg])
 
     def test_send_multi(self):
         conn = bytehand.Connection(userid=1342, key='MYKEY4321')
@@ -139,8 +207,7 @@ class TestBytehandConnection(TestCaseWithPatchedRequests):
             urlparse.urljoin(bytehand.API_URL,
                              'send_multi?id=1342&key=MYKEY4321')
         )
-        expected_data = json.dumps(msgs)
-        self.assertEqual(self.post_data, expected_data)
+        self.assertEqual(json.loads(self.post_data), msgs)
 
     def test_details(self):
         conn = bytehand.Connection(userid=1342, key='MYKEY4321')
@@ -220,6 +287,25 @@ class TestBytehandConnection(TestCaseWithPatchedRequests):
             lambda: conn.signature('NoSuchSignature')
         )
 
+    def test_signature_cache(self):
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321')
+        self.assertEqual(conn.signature('Peter')['id'], 42)
+        self.assertEqual(conn.signature_by_id(42)['text'], 'Peter')
+        self.assertEqual(len(self.request_urls), 1)
+
+        conn.new_signature('Paul', 'Another signature')
+        conn.signature('Peter')
+        self.assertEqual(len(self.request_urls), 3)
+
+        conn.refresh_signatures()
+        self.assertEqual(len(self.request_urls), 4)
+
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321',
+                                   signature_ttl=0)
+        conn.signature('Peter')
+        conn.signature('Peter')
+        self.assertEqual(len(self.request_urls), 6)
+
     def test_new_signature(self):
         conn = bytehand.Connection(userid=1342, key='MYKEY4321')
         test_sign = 'test'
@@ -235,8 +321,8 @@ class TestBytehandConnection(TestCaseWithPatchedRequests):
             urlparse.urljoin(bytehand.API_URL, 'signature')
         )
         self.assertEqual(
-            parsed_url.query,
-            urllib.urlencode(dict(id='1342', key='MYKEY4321', text=test_sign))
+            dict(kv.split('=') for kv in parsed_url.query.split('&')),
+            dict(id='1342', key='MYKEY4321', text=test_sign)
         )
         self.assertEqual(self.post_data, {'description': test_description})
 
@@ -255,6 +341,1052 @@ class TestBytehandConnection(TestCaseWithPatchedRequests):
             dict(id='1342', key='MYKEY4321', signature='42')
         )
 
+    def test_session_reused(self):
+        with bytehand.Connection(userid=1342, key='MYKEY4321') as conn:
+            conn.balance()
+            conn.details('12345')
+            self.assertIs(self.sessions[0], self.sessions[1])
+        self.assertIsNone(conn._session)
+
+        conn.balance()
+        self.assertIsNot(self.sessions[2], self.sessions[0])
+        conn.close()
+
+    def test_rate_limit(self):
+        limiter = bytehand.RateLimiter(messages_per_second=1000,
+                                       requests_per_second=1000)
+        acquired = []
+
+        def acquire(messages=1, requests=1):
+            acquired.append((messages, requests))
+        limiter.acquire = acquire
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321',
+                                   rate_limiter=limiter)
+        conn.balance()
+        conn.details('12345')
+        conn.send_multi([{'to': '1', 'from': 'Mom', 'text': 'Hi!'}])
+        self.assertEqual(sum(requests for _, requests in acquired), 3)
+        self.assertEqual(sum(messages for messages, _ in acquired), 1)
+
+
+class TestBytehandAsyncConnection(TestCaseWithPatchedRequests):
+
+    def test_send(self):
+        with bytehand.AsyncConnection(userid=1342, key='MYKEY4321',
+                                      concurrency=2) as conn:
+            future = conn.send(to=77712345678, signature='Mom',
+                               text='Hi!')
+            response = future.result(timeout=5)
+            self.assertEqual(response.description, '4242424242')
+            self.assertEqual(conn.balance().result(timeout=5), '100500.00')
+
+    def test_error(self):
+        with bytehand.AsyncConnection(userid=1342, key='MYKEY4321') as conn:
+            future = conn.signatures(state='unknown_state')
+            self.assertIsInstance(future.exception(timeout=5), ValueError)
+            self.assertRaises(ValueError, future.result)
+
+
+class TestBytehandDeliveryTracker(unittest.TestCase):
+
+    class FakeConnection(object):
+
+        def __init__(self, states):
+            self.states = states
+            self.requested = []
+
+        def details(self, msgid):
+            self.requested.append(msgid)
+            return {'status': 0, 'description': self.states[msgid].pop(0)}
+
+    def test_tracker(self):
+        conn = self.FakeConnection({
+            '1': ['NEW', 'DELIVERED'],
+            '2': ['REJECTED'],
+            '3': ['NEW', 'ACCEPTED', 'EXPIRED'],
+        })
+        seen = []
+        with bytehand.DeliveryTracker(conn, ['1', '2', '3'],
+                                      min_interval=0, max_interval=0,
+                                      on_transition=lambda *t: seen.append(t)
+                                      ) as tracker:
+            progress = tracker.run(timeout=5)
+            transitions = sorted(seen)
+        self.assertEqual(transitions, [
+            ('1', None, 'NEW'), ('1', 'NEW', 'DELIVERED'),
+            ('2', None, 'REJECTED'),
+            ('3', None, 'NEW'), ('3', 'ACCEPTED', 'EXPIRED'),
+            ('3', 'NEW', 'ACCEPTED'),
+        ])
+        self.assertEqual(conn.requested.count('2'), 1)
+        self.assertEqual(progress['done'], 3)
+        self.assertEqual(progress['pending'], 0)
+        self.assertEqual(progress['DELIVERED'], 1)
+
+    def test_tracker_gives_up(self):
+        class UnknownConnection(object):
+            def details(self, msgid):
+                return {'status': 1, 'description': 'Unknown message'}
+
+        with bytehand.DeliveryTracker(UnknownConnection(), ['1'],
+                                      min_interval=0, max_interval=0,
+                                      max_errors=3) as tracker:
+            progress = tracker.run(timeout=5)
+            self.assertTrue(tracker.done)
+            self.assertEqual(tracker.errors['1'], 'Unknown message')
+        self.assertEqual(progress['failed'], 1)
+        self.assertEqual(progress['pending'], 0)
+        self.assertEqual(progress['done'], 0)
+
+
+class TestBytehandBalanceMonitor(TestCaseWithPatchedRequests):
+
+    def test_balance_monitor(self):
+        from decimal import Decimal
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321')
+        crossed = []
+        monitor = bytehand.BalanceMonitor(
+            conn, ttl=60, thresholds=[100500, 100499],
+            on_threshold=lambda *args: crossed.append(args))
+        self.assertEqual(monitor.value(), Decimal('100500.00'))
+        self.assertEqual(monitor.value(), Decimal('100500.00'))
+        self.assertEqual(len(self.request_urls), 1)
+
+        monitor.record_cost('1', '0.5')
+        monitor.record_cost('1', '0.5')
+        self.assertEqual(monitor.estimate(), Decimal('100499.50'))
+        self.assertEqual(crossed, [(100500, Decimal('100499.50'))])
+
+        self.assertEqual(monitor.refresh(), Decimal('100500.00'))
+        monitor.record_cost('1', '0.5')
+        self.assertEqual(monitor.estimate(), Decimal('100500.00'))
+        monitor.record_cost('2', '0.5')
+        self.assertEqual(len(crossed), 2)
+        monitor.close()
+
+
+class TestBytehandRateLimit(unittest.TestCase):
+
+    def test_token_bucket(self):
+        from bytehand.ratelimit import TokenBucket
+        bucket = TokenBucket(rate=1000, capacity=2)
+        self.assertTrue(bucket.try_acquire(2))
+        self.assertFalse(bucket.try_acquire(2))
+        bucket.acquire(5)
+
+    def test_file_token_bucket_is_shared(self):
+        from bytehand.ratelimit import FileTokenBucket
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'limit')
+            first = FileTokenBucket(path, rate=0.001, capacity=3)
+            second = FileTokenBucket(path, rate=0.001, capacity=3)
+            self.assertTrue(first.try_acquire(2))
+            self.assertFalse(second.try_acquire(2))
+            self.assertTrue(second.try_acquire(1))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_scheduler_priorities(self):
+        started = threading.Event()
+        release = threading.Event()
+        sent = []
+
+        class FakeConnection(object):
+            def send_multi(self, msgs):
+                sent.extend(msg['text'] for msg in msgs)
+                started.set()
+                release.wait(5)
+                return ['response ' + msg['text'] for msg in msgs]
+
+        with bytehand.SendScheduler(FakeConnection(), batch_size=1) as sched:
+            first = sched.submit({'text': 'first'}, bytehand.PRIORITY_LOW)
+            started.wait(5)
+            futures = [
+                sched.submit({'text': 'ads'}, bytehand.PRIORITY_LOW),
+                sched.submit({'text': 'otp'}, bytehand.PRIORITY_HIGH),
+                sched.submit({'text': 'news'}),
+            ]
+            release.set()
+            self.assertEqual([f.result(5) for f in futures],
+                             ['response ads', 'response otp',
+                              'response news'])
+        self.assertEqual(first.result(), 'response first')
+        self.assertEqual(sent, ['first', 'otp', 'news', 'ads'])
+
+
+class TestBytehandRetry(TestCaseWithPatchedRequests):
+
+    def setUp(self):
+        super(TestBytehandRetry, self).setUp()
+        self.posted = []
+        self.failures = []
+        self.message_failures = set()
+
+        def patched_request(session, method, url, **kwargs):
+            resp = requests.Response()
+            if self.failures:
+                resp.status_code = self.failures.pop(0)
+                return resp
+            resp.status_code = 200
+            if method == 'get':
+                resp._content = self.balance_response.content
+                return resp
+            msgs = json.loads(kwargs['data'])
+            self.posted.append([msg['to'] for msg in msgs])
+            result = []
+            for msg in msgs:
+                if msg['to'] in self.message_failures:
+                    self.message_failures.discard(msg['to'])
+                    result.append({'status': 5, 'description': 'busy'})
+                else:
+                    result.append({'status': 0, 'description': msg['to']})
+            resp._content = json.dumps(result)
+            return resp
+        requests.Session.request = patched_request
+
+    def connection(self, **kwargs):
+        policy = bytehand.RetryPolicy(backoff=0, **kwargs)
+        return bytehand.Connection(userid=1342, key='MYKEY4321',
+                                   retry=policy)
+
+    def test_retry_transient_status(self):
+        self.failures = [503, 502]
+        self.assertEqual(self.connection().balance(), '100500.00')
+
+        self.failures = [503, 503, 503]
+        with self.assertRaises(bytehand.HTTPError) as raised:
+            self.connection().balance()
+        self.assertEqual(raised.exception.status_code, 503)
+
+        self.failures = [400]
+        self.assertRaises(bytehand.HTTPError, self.connection().balance)
+        self.assertEqual(self.failures, [])
+
+    def test_retry_send_multi_resubmits_only_failed(self):
+        self.failures = [503]
+        self.message_failures = set(['2'])
+        msgs = [{'to': str(n), 'from': 'Mom', 'text': 'Hi!'}
+                for n in xrange(3)]
+        responses = self.connection(
+            message_statuses=[5]).send_multi(msgs)
+        self.assertEqual([resp.description for resp in responses],
+                         ['0', '1', '2'])
+        self.assertEqual(self.posted, [['0', '1', '2'], ['2']])
+
+    def test_retry_send_multi_non_ascii_text(self):
+        self.failures = [503]
+        response = self.connection().send(to='1', signature='Mom',
+                                          text='привет')
+        self.assertEqual(response.description, '1')
+        self.assertEqual(self.posted, [['1']])
+        from bytehand.dedup import message_digest
+        self.assertEqual(
+            message_digest({'to': 1, 'from': 'Mom', 'text': 'привет'}),
+            message_digest({'to': u'1', 'from': u'Mom',
+                            'text': u'привет'}))
+
+    def test_retry_attempts_are_instrumented(self):
+        self.failures = [503]
+        conn = self.connection()
+        events = []
+        conn.add_instrument(events.append)
+        conn.send(to='1', signature='Mom', text='Hi!')
+        self.assertEqual([(e.attempt, e.outcome) for e in events],
+                         [(1, 'http_error'), (2, 'ok')])
+
+    def test_retry_send_multi_only_when_nothing_was_sent(self):
+        self.failures = [500]
+        conn = self.connection()
+        self.assertRaises(bytehand.HTTPError, conn.send,
+                          to='1', signature='Mom', text='Hi!')
+        self.assertEqual(self.failures, [])
+
+        policy = bytehand.RetryPolicy()
+        refused = requests.exceptions.ConnectionError(
+            requests.packages.urllib3.exceptions.MaxRetryError(
+                None, '/', requests.packages.urllib3.exceptions
+                .NewConnectionError(None, 'refused')))
+        aborted = requests.exceptions.ConnectionError(
+            'Connection aborted.')
+        self.assertTrue(policy.is_send_retryable(refused))
+        self.assertTrue(policy.is_send_retryable(
+            requests.exceptions.ConnectTimeout()))
+        self.assertFalse(policy.is_send_retryable(aborted))
+        self.assertTrue(policy.is_retryable(aborted))
+        self.assertTrue(bytehand.RetryPolicy(
+            send_exceptions=[requests.exceptions.ConnectionError]
+        ).is_send_retryable(aborted))
+
+    def test_dedup_skips_recent_sends(self):
+        self.message_failures = set(['2'])
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321',
+                                   dedup=bytehand.Deduplicator(window=60))
+        first = conn.send(to='1', signature='Mom', text='Hi!')
+        self.assertIs(conn.send(to='1', signature='Mom', text='Hi!'), first)
+        msgs = [{'to': n, 'from': 'Mom', 'text': 'Hi!'}
+                for n in ('1', '2', '3', '2')]
+        responses = conn.send_multi(msgs)
+        self.assertIs(responses[0], first)
+        self.assertEqual(responses[1].status, 5)
+        self.assertIs(responses[3], responses[1])
+        conn.send_multi(msgs)
+        self.assertEqual(self.posted, [['1'], ['2', '3'], ['2']])
+
+    def test_dedup_string_status_and_non_ascii_text(self):
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321',
+                                   dedup=bytehand.Deduplicator(window=60))
+
+        def patched_request(session, method, url, **kwargs):
+            self.posted.append(kwargs['data'])
+            return self.ok_response
+        requests.Session.request = patched_request
+        first = conn.send(to='1', signature='Mom', text='привет')
+        second = conn.send(to='1', signature='Mom', text=u'привет')
+        self.assertEqual(first.status, '0')
+        self.assertIs(second, first)
+        self.assertEqual(len(self.posted), 1)
+        self.assertEqual(len(conn.dedup), 1)
+
+    def test_dedup_shares_inflight_request(self):
+        from bytehand.dedup import Deduplicator
+        dedup = Deduplicator(window=60, max_entries=2)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def send(msgs):
+            calls.append(len(msgs))
+            started.set()
+            release.wait()
+            return [bytehand.connection._SMSResponse(None, 0, m['to'])
+                    for m in msgs]
+        msg = {'to': '1', 'from': 'Mom', 'text': 'Hi!'}
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(dedup.send_multi(send, [msg])))
+        thread.start()
+        started.wait()
+        waiter = threading.Thread(
+            target=lambda: results.append(dedup.send_multi(send, [msg])))
+        waiter.start()
+        release.set()
+        thread.join()
+        waiter.join()
+        self.assertEqual(calls, [1])
+        self.assertIs(results[0][0], results[1][0])
+
+        for n in xrange(3):
+            dedup.send_multi(send, [dict(msg, to=str(n + 2))])
+        self.assertEqual(len(dedup), 2)
+
+
+class TestBytehandResultStore(unittest.TestCase):
+
+    def test_result_store(self):
+        from bytehand.connection import _SMSResponse
+        store = bytehand.ResultStore()
+        store.extend([_SMSResponse(None, 0, '10000000001'),
+                      _SMSResponse(None, 3, 'Bad number'),
+                      None,
+                      _SMSResponse(None, '0', '10000000002')])
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.count_ok(), 2)
+        self.assertEqual(store.msgid(0), '10000000001')
+        self.assertEqual(store.msgid(1), None)
+
+        store.update(store.find('10000000002'),
+                     {'status': 0, 'description': 'DELIVERED',
+                      'parts': 2, 'cost': '0.70'})
+        store.update(0, {'status': 0, 'description': 'NEW',
+                         'parts': 1, 'cost': '0.35'})
+        self.assertEqual(store[3], (0, '10000000002', 'DELIVERED', 2, 0.7))
+        self.assertEqual(store.count('DELIVERED'), 1)
+        self.assertEqual(store.count(), 2)
+        self.assertAlmostEqual(store.total_cost(), 1.05)
+        self.assertEqual(store.total_parts(), 3)
+        self.assertRaises(LookupError, lambda: store.find('42'))
+
+    def test_sms_response_has_no_dict(self):
+        from bytehand.connection import _SMSResponse
+        self.assertFalse(hasattr(_SMSResponse(None, 0, '1'), '__dict__'))
+
+
+class TestBytehandOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'outbox.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    class FakeConnection(object):
+
+        def __init__(self, fail_after=None, status=429):
+            self.sent = []
+            self.fail_after = fail_after
+            self.status = status
+
+        def send_multi(self, msgs):
+            from bytehand.connection import _SMSResponse
+            if self.fail_after is not None and \
+                    len(self.sent) >= self.fail_after:
+                raise bytehand.HTTPError('Gateway is down', self.status)
+            self.sent.extend(msg['to'] for msg in msgs)
+            return [_SMSResponse(self, 0, 'id' + msg['to']) for msg in msgs]
+
+    def test_resume_after_failure(self):
+        msgs = [{'to': str(n), 'from': 'Mom', 'text': 'Hi!'}
+                for n in xrange(5)]
+        with bytehand.Outbox(self.path) as outbox:
+            self.assertEqual(outbox.put(msgs), 5)
+            conn = self.FakeConnection(fail_after=2)
+            self.assertRaises(bytehand.HTTPError,
+                              lambda: outbox.send_pending(conn,
+                                                          batch_size=2))
+            self.assertEqual(outbox.counts()['sent'], 2)
+
+        with bytehand.Outbox(self.path) as outbox:
+            self.assertEqual(outbox.recover(), 0)
+            conn = self.FakeConnection()
+            self.assertEqual(outbox.send_pending(conn, batch_size=2), 3)
+            self.assertEqual(conn.sent, ['2', '3', '4'])
+            self.assertEqual([result[3] for result in outbox.results()],
+                             ['id' + str(n) for n in xrange(5)])
+
+    def test_recover_in_flight(self):
+        with bytehand.Outbox(self.path) as outbox:
+            outbox.put([{'to': '1', 'from': 'Mom', 'text': 'Hi!'}])
+            outbox._take(1)
+            self.assertEqual(outbox.counts()['in_flight'], 1)
+        with bytehand.Outbox(self.path) as outbox:
+            self.assertEqual(outbox.recover(), 1)
+            self.assertEqual(outbox.counts()['uncertain'], 1)
+            self.assertEqual(outbox.send_pending(self.FakeConnection()), 0)
+
+    def test_server_error_leaves_batch_in_flight(self):
+        with bytehand.Outbox(self.path) as outbox:
+            outbox.put([{'to': str(n), 'from': 'Mom', 'text': 'Hi!'}
+                        for n in xrange(3)])
+            conn = self.FakeConnection(fail_after=0, status=502)
+            self.assertRaises(bytehand.HTTPError,
+                              lambda: outbox.send_pending(conn,
+                                                          batch_size=2))
+            self.assertEqual(outbox.counts()['in_flight'], 2)
+            self.assertEqual(outbox.recover(), 2)
+            self.assertEqual(outbox.counts()['uncertain'], 2)
+            self.assertEqual(outbox.send_pending(self.FakeConnection()), 1)
+
+
+class TestBytehandCli(TestCaseWithPatchedRequests):
+
+    def test_cli(self):
+        import StringIO
+        from bytehand import cli
+        stdin = StringIO.StringIO(
+            'to,text\n'
+            '77712345678,Hi!\n'
+            'bad_number,Hi!\n'
+            '77712345679,\n'
+        )
+        stdout = StringIO.StringIO()
+        stderr = StringIO.StringIO()
+        code = cli.main(['--userid', '1342', '--key', 'MYKEY4321',
+                         '--signature', 'Mom', '--format', 'csv'],
+                        stdin=stdin, stdout=stdout, stderr=stderr)
+        self.assertEqual(code, 1)
+        results = [json.loads(line) for line in
+                   stdout.getvalue().splitlines()]
+        self.assertEqual(sorted(result['line'] for result in results),
+                         [1, 2, 3])
+        sent = [result for result in results if result['line'] == 1][0]
+        self.assertEqual(sent['description'], '4242424242')
+        self.assertEqual(json.loads(self.post_data),
+                         [{'to': '77712345678', 'from': 'Mom',
+                           'text': 'Hi!'}])
+        self.assertIn('rejected: 2', stderr.getvalue())
+
+    def test_cli_rejects_non_ascii_phone(self):
+        import StringIO
+        from bytehand import cli
+        stdin = StringIO.StringIO('{"to": "7777\\u0444", "text": "Hi!"}\n'
+                                  '{"to": "77712345678", "text": "Hi!"}\n')
+        stdout = StringIO.StringIO()
+        stderr = StringIO.StringIO()
+        code = cli.main(['--userid', '1342', '--key', 'MYKEY4321',
+                         '--signature', 'Mom'],
+                        stdin=stdin, stdout=stdout, stderr=stderr)
+        self.assertEqual(code, 1)
+        results = [json.loads(line) for line in
+                   stdout.getvalue().splitlines()]
+        self.assertEqual([('error' in result, result['line'])
+                          for result in results], [(True, 1), (False, 2)])
+        self.assertIn('rejected: 1', stderr.getvalue())
+
+    def test_cli_window_is_bounded(self):
+        from bytehand import cli
+        pulled = []
+        done = []
+
+        class Pool(object):
+
+            def apply_async(self, func, args):
+                return self
+
+            def get(self):
+                done.append(True)
+                return None, [], 0.0
+
+        def batches():
+            for n in xrange(20):
+                pulled.append(n)
+                self.assertTrue(len(pulled) - len(done) <= 5)
+                yield [(n, 'reject')], [(n, {'to': str(n)})]
+        results = list(cli._send_all(batches(), Pool(), 4))
+        self.assertEqual(len(results), 20)
+        self.assertEqual([rejects[0][0] for rejects, _ in results],
+                         range(20))
+
+
+class TestBytehandBatchValidator(TestCaseWithPatchedRequests):
+
+    def test_validate(self):
+        from bytehand import validate
+        validator = bytehand.BatchValidator.from_connection(
+            bytehand.Connection(userid=1342, key='MYKEY4321'))
+        query = urlparse.urlparse(self.last_url).query
+        self.assertEqual(dict(kv.split('=') for kv in query.split('&')),
+                         dict(id='1342', key='MYKEY4321', state='ACCEPTED'))
+        msgs = [
+            {'to': '+7 (777) 123-45-67', 'from': 'Peter', 'text': 'Hi!'},
+            {'to': u'7-777-123-45-68', 'from': 'Peter', 'text': 'Hi!'},
+            {'to': 'bad_number', 'from': 'Peter', 'text': 'Hi!'},
+            {'to': '123', 'from': 'Peter', 'text': 'Hi!'},
+            {'to': 77771234569, 'from': 'Peter', 'text': ''},
+            {'to': 77771234569, 'from': '', 'text': 'Hi!'},
+            {'to': 77771234569, 'from': 'Paul', 'text': 'Hi!'},
+            {'to': '77771234567', 'from': 'Peter', 'text': 'Hi again!'},
+        ]
+        clean, rejects = validator.validate(msgs)
+        self.assertEqual(clean, [
+            {'to': '77771234567', 'from': 'Peter', 'text': 'Hi!'},
+            {'to': '77771234568', 'from': 'Peter', 'text': 'Hi!'},
+        ])
+        self.assertEqual([(r.index, r.reason) for r in rejects], [
+            (2, validate.BAD_NUMBER), (3, validate.BAD_NUMBER),
+            (4, validate.EMPTY_TEXT), (5, validate.NO_SIGNATURE),
+            (6, validate.UNVERIFIED_SIGNATURE), (7, validate.DUPLICATE),
+        ])
+
+        clean, rejects = validator.validate(msgs[:1])
+        self.assertEqual([r.reason for r in rejects], [validate.DUPLICATE])
+        validator.reset()
+        clean, rejects = validator.validate(msgs[:1])
+        self.assertEqual(len(clean), 1)
+
+
+class TestBytehandParts(unittest.TestCase):
+
+    def test_count_parts_gsm7(self):
+        self.assertEqual(bytehand.count_parts(''), 1)
+        self.assertEqual(bytehand.count_parts('a' * 160), 1)
+        self.assertEqual(bytehand.count_parts('a' * 161), 2)
+        self.assertEqual(bytehand.count_parts('a' * 306), 2)
+        self.assertEqual(bytehand.count_parts('a' * 307), 3)
+        # Extension characters take two septets and are not split.
+        self.assertEqual(bytehand.count_parts('{' * 80), 1)
+        self.assertEqual(bytehand.count_parts('{' * 81), 2)
+        self.assertEqual(bytehand.count_parts('a' * 159 + '{'), 2)
+        self.assertEqual(bytehand.count_parts('a' * 152 + '{' * 77), 3)
+
+    def test_count_parts_ucs2(self):
+        text = 'Привет'
+        self.assertEqual(bytehand.count_parts(text), 1)
+        self.assertEqual(bytehand.count_parts(u'ж' * 70), 1)
+        self.assertEqual(bytehand.count_parts(u'ж' * 71), 2)
+        self.assertEqual(bytehand.count_parts(u'ж' * 134), 2)
+        self.assertEqual(bytehand.count_parts(u'ж' * 135), 3)
+        smile = u'\U0001F600'
+        self.assertEqual(bytehand.count_parts(u'a' * 68 + smile), 1)
+        self.assertEqual(bytehand.count_parts(u'a' * 69 + smile), 2)
+        # Surrogate pairs are not split between parts.
+        self.assertEqual(
+            bytehand.count_parts(u'a' * 66 + smile + u'a' * 66), 3)
+
+    def test_estimate(self):
+        tariff = bytehand.Tariff('0.5', prefixes={'7': '0.3', '79': '0.2'})
+        result = bytehand.estimate([
+            {'to': '79001234567', 'from': 'Mom', 'text': 'a' * 161},
+            {'to': '77001234567', 'from': 'Mom', 'text': 'Hi!'},
+            {'to': '38001234567', 'from': 'Mom', 'text': 'Hi!'},
+        ], tariff)
+        self.assertEqual(result.messages, 3)
+        self.assertEqual(result.parts, 4)
+        self.assertEqual(str(result.cost), '1.2')
+
+
+class TestBytehandMetrics(TestCaseWithPatchedRequests):
+
+    def test_instruments(self):
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321')
+        events = []
+        collector = bytehand.MetricsCollector()
+        conn.add_instrument(events.append)
+        conn.add_instrument(collector)
+
+        conn.send_multi([{'to': '1', 'from': 'Mom', 'text': 'Hi!'}])
+        sent_bytes = len(self.post_data)
+        conn.balance()
+        self.assertEqual([(e.method, e.endpoint, e.outcome, e.batch_size)
+                          for e in events],
+                         [('post', 'send_multi', 'ok', 1),
+                          ('get', 'balance', 'ok', None)])
+        self.assertEqual(events[0].bytes_sent, sent_bytes)
+        self.assertEqual(events[1].bytes_received,
+                         len(self.balance_response.content))
+
+        text = bytehand.prometheus_text(collector)
+        self.assertIn('bytehand_requests_total{endpoint="send_multi",'
+                      'method="post",outcome="ok"} 1', text)
+        self.assertIn('bytehand_messages_total{endpoint="send_multi",'
+                      'method="post"} 1', text)
+        self.assertIn('bytehand_request_duration_seconds_count'
+                      '{endpoint="balance",method="get"} 1', text)
+
+        statsd = bytehand.StatsdExporter()
+        self.assertIn('bytehand.send_multi.messages:1|c',
+                      statsd.format(events[0]))
+        statsd.close()
+
+        conn.remove_instrument(events.append)
+        conn.balance()
+        self.assertEqual(len(events), 2)
+
+
+class TestBytehandFakeGateway(unittest.TestCase):
+
+    def test_fake_gateway(self):
+        from bytehand.testing import FakeGateway
+        with FakeGateway(price='0.5') as gateway:
+            gateway.add_signature('Peter')
+            with bytehand.Connection(userid=1342, key='MYKEY4321',
+                                     api_url=gateway.url) as conn:
+                events = []
+                conn.add_instrument(events.append)
+                resp = conn._request(conn._protocol.signatures(),
+                                     stream=True)
+                self.assertEqual(events, [])
+                self.assertEqual(len(list(conn._parse_array(resp, 0))), 1)
+                self.assertEqual(len(events), 1)
+                self.assertTrue(events[0].bytes_received > 0)
+                conn.remove_instrument(events.append)
+
+                response = conn.send(to=77712345678, signature='Peter',
+                                     text='Hi!')
+                self.assertTrue(response.ok)
+                self.assertTrue(response.is_delivered)
+                self.assertEqual(response.details['cost'], '0.5')
+                self.assertEqual(conn.balance(), '100499.50')
+                self.assertEqual(conn.signature('Peter')['state'],
+                                 'ACCEPTED')
+                conn.new_signature('Paul', 'Second')
+                self.assertEqual(conn.signature('Paul')['state'], 'NEW')
+                conn.delete_signature('Paul')
+                self.assertRaises(LookupError,
+                                  lambda: conn.signature('Paul'))
+
+    def test_fake_gateway_errors(self):
+        from bytehand.testing import FakeGateway
+        with FakeGateway(error_rate=1.0) as gateway:
+            conn = bytehand.Connection(userid=1342, key='MYKEY4321',
+                                       api_url=gateway.url)
+            with self.assertRaises(bytehand.HTTPError) as raised:
+                conn.balance()
+            self.assertEqual(raised.exception.status_code, 503)
+            conn.close()
+
+
+class TestBytehandDeliveryReceiver(unittest.TestCase):
+
+    def call(self, receiver, query='', body='', content_type=''):
+        import StringIO
+        statuses = []
+        environ = {'QUERY_STRING': query, 'CONTENT_LENGTH': str(len(body)),
+                   'CONTENT_TYPE': content_type,
+                   'wsgi.input': StringIO.StringIO(body)}
+        receiver(environ, lambda status, headers: statuses.append(status))
+        return statuses[0]
+
+    def test_reports(self):
+        reports = []
+        receiver = bytehand.DeliveryReceiver(
+            on_report=lambda *args: reports.append(args))
+        first = receiver.watch('1')
+        second = receiver.watch(2)
+        self.assertEqual(len(receiver), 2)
+
+        self.assertEqual(self.call(receiver, 'message=1&state=ACCEPTED'),
+                         '200 OK')
+        self.assertFalse(first.done())
+        self.assertEqual(receiver.state('1'), 'ACCEPTED')
+        self.assertEqual(self.call(receiver, body='msgid=1&status=EXPIRED',
+                                   content_type='application/x-www-form-'
+                                                'urlencoded'), '200 OK')
+        self.assertEqual(first.result(0), 'EXPIRED')
+        self.assertEqual(self.call(receiver, body='{"id": 2, "description":'
+                                                  ' "DELIVERED"}',
+                                   content_type='application/json'),
+                         '200 OK')
+        self.assertEqual(second.result(0), 'DELIVERED')
+        third = receiver.watch('5')
+        self.assertEqual(self.call(receiver, body='{"message": "5", '
+                                                  '"status": 0, "description":'
+                                                  ' "DELIVERED"}',
+                                   content_type='application/json'),
+                         '200 OK')
+        self.assertEqual(third.result(0), 'DELIVERED')
+        self.assertEqual(len(receiver), 0)
+        self.assertEqual(len(reports), 4)
+        self.assertEqual(self.call(receiver, 'message=3'),
+                         '400 Bad Request')
+
+    def test_poll_silent(self):
+        class FakeConnection(object):
+            def details(self, msgid):
+                return {'status': 0, 'description': 'DELIVERED'}
+
+        receiver = bytehand.DeliveryReceiver(FakeConnection(), silence=0)
+        future = receiver.watch('1')
+        self.assertEqual(receiver.poll_silent(), 1)
+        self.assertEqual(future.result(0), 'DELIVERED')
+        self.assertEqual(receiver.poll_silent(), 0)
+
+
+class TestBytehandSerializer(unittest.TestCase):
+
+    def test_encode_messages(self):
+        from bytehand.serializer import get_serializer
+        serializer = get_serializer('json')
+        msgs = [{'to': '1', 'from': u'Мама', 'text': 'Hi "Kate"!'},
+                {'to': 2, 'from': u'Мама', 'text': u'Привет'},
+                {'to': '3', 'from': 'Dad', 'text': 'Hi!', 'extra': 1}]
+        for _ in xrange(2):
+            self.assertEqual(json.loads(serializer.encode_messages(msgs)),
+                             json.loads(json.dumps(msgs)))
+        self.assertRaises(ImportError, lambda: get_serializer('orjson'))
+        self.assertRaises(ValueError, lambda: get_serializer('unknown'))
+
+    def test_iter_array(self):
+        from bytehand.serializer import iter_array
+        data = json.dumps([{'id': n, 'text': u'Привет {0}'.format(n)}
+                           for n in xrange(20)] + [1, 22, 333],
+                          ensure_ascii=False).encode('utf-8')
+        for size in (1, 2, 7, 100, len(data)):
+            chunks = [data[i:i + size] for i in xrange(0, len(data), size)]
+            self.assertEqual(list(iter_array(chunks)),
+                             json.loads(data.decode('utf-8')))
+        self.assertEqual(list(iter_array([' [ ] '])), [])
+        self.assertRaises(ValueError, lambda: list(iter_array(['[1, {'])))
+        self.assertRaises(ValueError, lambda: list(iter_array(['{}'])))
+        for bad in ('[1 2]', '[,,1,]', '[{"a":1}{"b":2}]', '[1,]', '[,]',
+                    '[1,,2]'):
+            self.assertRaises(ValueError, lambda: list(iter_array([bad])))
+        self.assertEqual(list(iter_array(['[1', ' ,', '2', ']'])), [1, 2])
+
+    def test_streamed_send_multi(self):
+        from bytehand.testing import FakeGateway
+        with FakeGateway() as gateway:
+            with bytehand.Connection(userid=1342, key='MYKEY4321',
+                                     api_url=gateway.url) as conn:
+                msgs = [{'to': str(n), 'from': 'Mom', 'text': 'Hi!'}
+                        for n in xrange(bytehand.definitions
+                                        .STREAM_DECODE_MESSAGES)]
+                responses = conn.send_multi(msgs)
+                self.assertEqual(len(responses), len(msgs))
+                self.assertTrue(all(resp.ok for resp in responses))
+
+
+class TestBytehandConnectionGroup(unittest.TestCase):
+
+    class FakeConnection(object):
+
+        def __init__(self, userid, failing=False, balance='0'):
+            self.userid = userid
+            self.failing = failing
+            self.sent = 0
+            self.messages = 0
+            self._balance = balance
+
+        def send_multi(self, msgs):
+            from bytehand.connection import _SMSResponse
+            if self.failing:
+                raise bytehand.HTTPError('Failed', self.failing)
+            self.sent += 1
+            self.messages += len(msgs)
+            return [_SMSResponse(self, 0, '{0}-{1}'.format(
+                self.userid, self.messages - len(msgs) + n))
+                for n in xrange(len(msgs))]
+
+        def details(self, msgid):
+            return {'status': 0, 'description': 'DELIVERED', 'by': self}
+
+        def balance(self):
+            return self._balance
+
+        def add_details_listener(self, listener):
+            pass
+
+        def remove_details_listener(self, listener):
+            pass
+
+        def close(self):
+            pass
+
+    def test_weights(self):
+        first, second = self.FakeConnection(1), self.FakeConnection(2)
+        group = bytehand.ConnectionGroup([first, second], weights=[3, 1])
+        responses = [group.send(to=1, signature='Mom', text='Hi!')
+                     for _ in xrange(8)]
+        self.assertEqual((first.sent, second.sent), (6, 2))
+        self.assertEqual([resp.description[0] for resp in responses],
+                         ['1', '1', '2', '1', '1', '1', '2', '1'])
+        self.assertIs(group.details('2-0')['by'], second)
+        self.assertIs(group.connection_for('1-0'), first)
+        self.assertRaises(LookupError, lambda: group.details('42'))
+
+    def test_failover_and_cooldown(self):
+        failing, healthy = self.FakeConnection(1, 429), \
+            self.FakeConnection(2)
+        group = bytehand.ConnectionGroup([failing, healthy], max_errors=2,
+                                         cooldown=60)
+        for _ in xrange(4):
+            group.send(to=1, signature='Mom', text='Hi!')
+        self.assertEqual(healthy.sent, 4)
+        stats = group.stats()
+        self.assertEqual(stats[0]['errors'], 2)
+        self.assertTrue(stats[0]['disabled_until'] > time.time())
+        self.assertEqual(stats[1]['messages'], 4)
+
+        healthy.failing = 503
+        self.assertRaises(bytehand.HTTPError,
+                          lambda: group.send(to=1, signature='Mom',
+                                             text='Hi!'))
+
+    def test_no_failover_on_client_error(self):
+        first, second = self.FakeConnection(1, 400), self.FakeConnection(2)
+        group = bytehand.ConnectionGroup([first, second], weights=[1, 0],
+                                         max_errors=1)
+        for _ in xrange(3):
+            self.assertRaises(bytehand.HTTPError,
+                              lambda: group.send(to=1, signature='Mom',
+                                                 text='Hi!'))
+        self.assertEqual(second.sent, 0)
+        self.assertEqual([stats['errors'] for stats in group.stats()],
+                         [0, 0])
+
+    def test_balance_strategy_charges_sent_batches(self):
+        first = self.FakeConnection(1, balance='10')
+        second = self.FakeConnection(2, balance='9.5')
+        group = bytehand.ConnectionGroup([first, second], strategy='balance')
+        responses = [group.send(to=1, signature='Mom', text='Hi!')
+                     for _ in xrange(4)]
+        self.assertEqual([resp.description[0] for resp in responses],
+                         ['1', '2', '1', '2'])
+
+    def test_latency_strategy(self):
+        first, second = self.FakeConnection(1), self.FakeConnection(2)
+        group = bytehand.ConnectionGroup([first, second], strategy='latency')
+        group._stats[0].latency = 0.5
+        group._stats[1].latency = 0.1
+        group.send(to=1, signature='Mom', text='Hi!')
+        self.assertEqual((first.sent, second.sent), (0, 1))
+
+
+class TestBytehandBulk(TestCaseWithPatchedRequests):
+
+    def setUp(self):
+        super(TestBytehandBulk, self).setUp()
+        self.posted = []
+
+        def patched_request(session, method, url, **kwargs):
+            msgs = json.loads(kwargs['data'])
+            self.posted.append(msgs)
+            resp = requests.Response()
+            if any(msg['text'] == 'fail' for msg in msgs):
+                resp.status_code = 500
+                return resp
+            resp.status_code = 200
+            resp._content = json.dumps(
+                [{'status': 0, 'description': msg['to']} for msg in msgs]
+            )
+            return resp
+        requests.Session.request = patched_request
+
+    def test_send_bulk(self):
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321')
+        msgs = [{'to': str(n), 'from': 'Mom', 'text': 'Hi!'}
+                for n in xrange(10)]
+        result = conn.send_bulk(msgs, chunk_size=3, workers=3)
+        self.assertTrue(result.ok)
+        self.assertEqual(sorted(len(chunk) for chunk in self.posted),
+                         [1, 3, 3, 3])
+        self.assertEqual([resp.description for resp in result],
+                         [msg['to'] for msg in msgs])
+
+    def test_send_bulk_partial_failure(self):
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321')
+        msgs = [{'to': str(n), 'from': 'Mom', 'text': 'Hi!'}
+                for n in xrange(6)]
+        msgs[4]['text'] = 'fail'
+        result = conn.send_bulk(msgs, chunk_size=2, workers=2)
+        self.assertFalse(result.ok)
+        self.assertEqual(len(result.failures), 1)
+        self.assertEqual(result.failures[0].offset, 4)
+        self.assertEqual(result.failures[0].msgs, msgs[4:6])
+        self.assertEqual([resp and resp.description for resp in result],
+                         ['0', '1', '2', '3', None, None])
+
+    def test_send_stream(self):
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321')
+        consumed = []
+
+        def messages():
+            for n in xrange(7):
+                consumed.append(n)
+                yield {'to': str(n), 'from': 'Mom', 'text': 'Hi!'}
+
+        stream = conn.send_stream(messages(), chunk_size=2, workers=2)
+        self.assertEqual(next(stream).description, '0')
+        self.assertTrue(len(consumed) < 7)
+        self.assertEqual([resp.description for resp in stream],
+                         [str(n) for n in xrange(1, 7)])
+
+    def test_send_stream_failure(self):
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321')
+        msgs = [{'to': str(n), 'from': 'Mom', 'text': 'Hi!'}
+                for n in xrange(4)]
+        msgs[0]['text'] = 'fail'
+        stream = conn.send_stream(iter(msgs), chunk_size=2, workers=1)
+        self.assertRaises(bytehand.BulkSendError, lambda: list(stream))
+
+        failures = []
+        stream = conn.send_stream(iter(msgs), chunk_size=2, workers=1,
+                                  on_error=failures.append)
+        self.assertEqual([resp.description for resp in stream], ['2', '3'])
+        self.assertEqual([f.offset for f in failures], [0])
+
+    def test_send_template(self):
+        conn = bytehand.Connection(userid=1342, key='MYKEY4321')
+        recipients = ((str(n), {'name': 'Kate' if n % 2 else 'Bob'})
+                      for n in xrange(5))
+        responses = conn.send_template(u'Hi, {name}!', 'Mom', recipients,
+                                       chunk_size=2, workers=2)
+        self.assertEqual([resp.description for resp in responses],
+                         [str(n) for n in xrange(5)])
+        self.assertEqual(self.posted[0], [
+            {'to': '0', 'from': 'Mom', 'text': 'Hi, Bob!'},
+            {'to': '1', 'from': 'Mom', 'text': 'Hi, Kate!'},
+        ])
+
+
+class TestBytehandTemplate(unittest.TestCase):
+
+    def test_render(self):
+        from bytehand.template import Template
+        tmpl = Template('Привет, {name}! "{sum:.2f}"')
+        self.assertEqual(tmpl.fields, ['name', 'sum'])
+        self.assertEqual(tmpl.render({'name': u'Катя', 'sum': 1.5}),
+                         u'Привет, Катя! "1.50"')
+        self.assertRaises(KeyError, lambda: tmpl.render({'name': 'Kate'}))
+        self.assertRaises(ValueError, lambda: Template('{} and {}'))
+        for text in ('{name!r}', '{user.name}', '{users[0]}',
+                     '{sum:{width}}'):
+            self.assertRaises(ValueError, Template, text)
+
+    def test_batch_encoder(self):
+        from bytehand.template import Template, BatchEncoder
+        encoder = BatchEncoder(Template(u'Привет, {name}!\n'), 'Mom')
+        body = encoder.encode([('1', {'name': 'Катя "K"'}),
+                               (2, {'name': u'Bob'})])
+        self.assertEqual(json.loads(body), [
+            {'to': '1', 'from': 'Mom', 'text': u'Привет, Катя "K"!\n'},
+            {'to': '2', 'from': 'Mom', 'text': u'Привет, Bob!\n'},
+        ])
+
+
+class TestBytehandDeferred(unittest.TestCase):
+
+    class _Connection(object):
+
+        def __init__(self):
+            self.batches = []
+
+        def send_multi(self, msgs):
+            self.batches.append([msg['to'] for msg in msgs])
+            return [msg['to'] for msg in msgs]
+
+    def test_window(self):
+        from bytehand.deferred import DeliveryWindow
+        window = DeliveryWindow(9, 21, utc_offset=3)
+        # 1970-01-01 05:00 UTC is 08:00 local
+        self.assertEqual(window.next_allowed(5 * 3600), 6 * 3600)
+        self.assertEqual(window.next_allowed(7 * 3600), 7 * 3600)
+        self.assertEqual(window.next_allowed(19 * 3600), 30 * 3600)
+        night = DeliveryWindow(22, 6)
+        self.assertEqual(night.next_allowed(23 * 3600), 23 * 3600)
+        self.assertEqual(night.next_allowed(12 * 3600), 22 * 3600)
+
+    def test_release(self):
+        from bytehand.deferred import DeferredSender
+        conn = self._Connection()
+        sent = []
+        sender = DeferredSender(conn, batch_size=2,
+                                on_sent=lambda key, r: sent.append(key))
+        for i, at in enumerate([30, 10, 20, 40]):
+            sender.schedule({'to': str(i), 'from': 'Mom', 'text': 'Hi'},
+                            at=at, key=i)
+        sender.schedule({'to': '3', 'from': 'Mom', 'text': 'Hi'},
+                        at=5, key=3)
+        self.assertTrue(sender.cancel(2))
+        self.assertFalse(sender.cancel(2))
+        self.assertEqual(len(sender), 3)
+        self.assertEqual(sender.next_due(), 5)
+        self.assertEqual(sender.release(now=35), 3)
+        self.assertEqual(conn.batches, [['3', '1'], ['0']])
+        self.assertEqual(sent, [3, 1, 0])
+        self.assertEqual(sender.next_due(), None)
+        self.assertEqual(sender.release(now=100), 0)
+
+    def test_background_errors_and_rate(self):
+        from bytehand.deferred import DeferredSender
+        conn = self._Connection()
+        send_multi = conn.send_multi
+        failures = [RuntimeError('down')]
+
+        def flaky_send_multi(msgs):
+            if failures:
+                raise failures.pop()
+            return send_multi(msgs)
+        conn.send_multi = flaky_send_multi
+        sender = DeferredSender(conn, max_rate=1000, tick=0.002)
+        for n in xrange(6):
+            sender.schedule({'to': str(n), 'from': 'Mom', 'text': 'Hi'},
+                            at=0)
+        logger = logging.getLogger('bytehand.deferred')
+        logger.disabled = True
+        try:
+            sender.start()
+            for _ in xrange(100):
+                if not len(sender):
+                    break
+                time.sleep(0.01)
+            sender.stop()
+        finally:
+            logger.disabled = False
+        self.assertEqual(len(sender), 0)
+        self.assertEqual(conn.batches, [['2', '3'], ['4', '5']])
+
 
 if __name__ == '__main__':
     unittest.main()